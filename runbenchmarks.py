@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Runs benchmarks of the django-ssify request pipeline.
+
+Uses the same Django configuration as the tests. Results are printed,
+and can be saved as JSON with --output, to be compared with results
+of another run with --compare:
+
+    python runbenchmarks.py --output before.json
+    # upgrade, change, etc.
+    python runbenchmarks.py --compare before.json
+
+Times are given per call, as the best and the median of the repeats.
+
+Results recorded for a release are kept in benchmarks.json. With
+--threshold, a run fails if any benchmark got slower than the compared
+results by more than the given ratio:
+
+    python runbenchmarks.py --compare benchmarks.json --threshold 1.25
+
+"""
+from __future__ import print_function, unicode_literals
+import json
+import platform
+import sys
+import timeit
+from optparse import OptionParser
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(abspath(__file__)))
+import runtests  # Configures the settings.
+
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Registers a benchmark: a function returning a callable to time."""
+    def dec(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return dec
+
+
+def make_request(path='/'):
+    from django.test.client import RequestFactory
+    request = RequestFactory().get(path)
+    request.ssi_vars_needed = {}
+    request.ssi_patch_response = []
+    return request
+
+
+@benchmark('variable_name.interned')
+def bench_variable_name_interned():
+    from ssify import SsiVariable as V
+
+    def run():
+        return V('test_tags.random_number', (), {'limit': 3}).name
+    return run
+
+
+@benchmark('variable_name.new')
+def bench_variable_name_new():
+    from ssify import SsiVariable as V
+    counter = [0]
+
+    def run():
+        counter[0] += 1
+        return V('test_tags.random_number', (), {'limit': counter[0]}).name
+    return run
+
+
+def _bench_template(source, context=None):
+    from django.template import Context, Template
+    template = Template(source)
+    context = context or {}
+
+    def run():
+        request = make_request()
+        return template.render(Context(dict(context, request=request)))
+    return run
+
+
+@benchmark('variable_node.render.100')
+def bench_variable_node_render():
+    return _bench_template(
+        '{% load test_tags %}'
+        '{% for i in numbers %}{% random_number limit=i %}{% endfor %}',
+        {'numbers': range(100)})
+
+
+@benchmark('ssi_include.100')
+def bench_ssi_include():
+    return _bench_template(
+        '{% load ssify %}'
+        '{% for i in numbers %}{% ssi_include "quote" number=i %}'
+        '{% endfor %}',
+        {'numbers': range(100)})
+
+
+@benchmark('ssi_include_each.100')
+def bench_ssi_include_each():
+    return _bench_template(
+        '{% load ssify %}{% ssi_include_each "quote" "number" numbers %}',
+        {'numbers': range(100)})
+
+
+def _wide(size):
+    from ssify import SsiVariable as V
+    return [V('test_tags.random_number', (), {'limit': i})
+            for i in range(size)]
+
+
+def _deep(depth):
+    from ssify import SsiVariable as V
+    ssi_vars = [V('test_tags.number_of_quotes')]
+    for i in range(depth - 1):
+        ssi_vars.append(
+            V('test_tags.random_number', (), {'limit': ssi_vars[-1]}))
+    return ssi_vars
+
+
+def _bench_provide_vars(ssi_vars):
+    from django.http import HttpRequest
+    from ssify.variables import provide_vars
+    ssi_vars = dict((var.name, var) for var in ssi_vars)
+
+    def run():
+        return provide_vars(HttpRequest(), ssi_vars)
+    return run
+
+
+for _size in (10, 100, 1000):
+    benchmark('provide_vars.wide.%d' % _size)(
+        lambda size=_size: _bench_provide_vars(_wide(size)))
+for _depth in (10, 50, 200):
+    benchmark('provide_vars.deep.%d' % _depth)(
+        lambda depth=_depth: _bench_provide_vars(_deep(depth)))
+
+
+@benchmark('set_statements.1000')
+def bench_set_statements():
+    from django.http import HttpRequest
+    from ssify.variables import set_statements
+    resolved = dict(('v%032x' % i, i % 10 if i % 2 else "it's %d" % (i % 10))
+                    for i in range(1000))
+
+    def run():
+        return set_statements(HttpRequest(), resolved)
+    return run
+
+
+@benchmark('middleware.roundtrip.100')
+def bench_middleware_roundtrip():
+    """
+    A response goes through PrepareForCacheMiddleware on its way
+    to the cache, and through SsiMiddleware on the way out of it.
+    """
+    from django.http import HttpResponse
+    from ssify.middleware import PrepareForCacheMiddleware, SsiMiddleware
+    from ssify.utils import ssi_vary_on_cookie
+    ssi_vars = dict((var.name, var) for var in _wide(100))
+    content = b'x' * 10000
+
+    def run():
+        request = make_request()
+        request.ssi_vars_needed = dict(ssi_vars)
+        request.ssi_patch_response = [ssi_vary_on_cookie]
+        response = PrepareForCacheMiddleware.process_response(
+            request, HttpResponse(content))
+
+        cached = HttpResponse(response.content)
+        for header, value in response.items():
+            cached[header] = value
+        request = make_request()
+        SsiMiddleware().process_request(request)
+        del request.ssi_vars_needed
+        return SsiMiddleware().process_response(request, cached)
+    return run
+
+
+def _synthetic_page(size):
+    """A page setting, testing and echoing variables, and including."""
+    from ssify.cache import set_many_includes
+    includes = dict(('/bench/%d' % i, ('<p>Include %d</p>' % i).encode())
+                    for i in range(10))
+    set_many_includes(includes)
+    page = []
+    for i in range(size):
+        page.append(
+            "<!--#set var='v%d' value='%d'-->"
+            "<!--#if expr='${v%d}'--><b><!--#echo var='v%d'--></b>"
+            "<!--#else-->nothing<!--#endif-->"
+            "<!--#include file='/bench/%d'-->" % (i, i, i, i, i % 10))
+    return ''.join(page).encode('ascii')
+
+
+@benchmark('render.page.100')
+def bench_render():
+    from ssify.middleware_debug import SsiRenderer
+    page = _synthetic_page(100)
+
+    def run():
+        return b''.join(SsiRenderer(make_request()).render([page]))
+    return run
+
+
+def measure(run, repeat, min_time):
+    """Returns per-call times of repeats, each taking about min_time."""
+    timer = timeit.Timer(run)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time / 10 or number >= 10 ** 6:
+            break
+        number *= 10
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    times = [t / number for t in timer.repeat(repeat, number)]
+    return number, sorted(times)
+
+
+def environment():
+    """Describes what's being measured."""
+    import django
+    import ssify
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'ssify': ssify.__version__,
+    }
+
+
+def run_benchmarks(names=None, repeat=5, min_time=0.2):
+    """Yields (name, result) for benchmarks matching any of the names."""
+    import django
+    try:
+        django.setup()
+    except AttributeError:
+        # Django < 1.7
+        pass
+
+    for name, setup in BENCHMARKS:
+        if names and not any(part in name for part in names):
+            continue
+        number, times = measure(setup(), repeat, min_time)
+        yield name, {
+            'best': times[0],
+            'median': times[len(times) // 2],
+            'number': number,
+            'repeat': repeat,
+        }
+
+
+def _format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.3f %s' % (seconds / scale, unit)
+    return '%.0f ns' % (seconds / 1e-9)
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option('--output', dest='output',
+                      help='Save the results as JSON.')
+    parser.add_option('--compare', dest='compare',
+                      help='Compare with results saved as JSON.')
+    parser.add_option('--threshold', type='float', dest='threshold',
+                      help='With --compare, fail if a benchmark is slower '
+                           'than the compared one by more than this ratio.')
+    parser.add_option('--repeat', type='int', default=5, dest='repeat')
+    parser.add_option('--min-time', type='float', default=0.2,
+                      dest='min_time',
+                      help='Minimum time of a single repeat, in seconds.')
+    options, names = parser.parse_args()
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    regressions = []
+    for name, result in run_benchmarks(names, options.repeat,
+                                       options.min_time):
+        results[name] = result
+        line = '%-28s %12s  (median %s)' % (
+            name, _format_time(result['best']),
+            _format_time(result['median']))
+        if name in baseline:
+            ratio = result['best'] / baseline[name]['best']
+            line += '  %.2fx' % ratio
+            if options.threshold and ratio > options.threshold:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print(line)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'meta': environment(), 'results': results}, f,
+                      indent=2, separators=(',', ': '), sort_keys=True)
+
+    if regressions:
+        print('%d benchmark(s) slower than %.2fx: %s' % (
+            len(regressions), options.threshold, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
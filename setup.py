@@ -7,7 +7,7 @@ from setuptools import setup, find_packages
 
 setup(
     name='django-ssify',
-    version='0.2.1',
+    version='0.3',
     author='Radek Czajka',
     author_email='radekczajka@nowoczesnapolska.org.pl',
     url='http://git.mdrn.pl/django-ssify.git',
@@ -14,10 +14,12 @@ with `ssi_included` decorator.
 """
 from __future__ import unicode_literals
 
-__version__ = '1.0'
+__version__ = '0.3'
 __date__ = '2014-08-26'
-__all__ = ('flush_ssi_includes', 'ssi_expect', 'SsiVariable', 'ssi_included', 'ssi_variable')
+__all__ = ('flush_ssi_includes', 'ssi_depends_on', 'ssi_expect',
+           'SsiVariable', 'ssi_included', 'ssi_variable')
 
 from .variables import ssi_expect, SsiVariable
 from .decorators import ssi_included, ssi_variable
 from .cache import flush_ssi_includes
+from .dependencies import ssi_depends_on
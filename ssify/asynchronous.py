@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Support for asynchronous SSI variables and ASGI deployments.
+
+This module needs Python 3.5+, and is only imported when used:
+by `ssi_variable` for `async def` functions, and by SsiMiddleware
+when it's called asynchronously.
+
+Values of variables on the same level of dependencies are computed
+concurrently: async variables are awaited with `asyncio.gather`,
+and sync ones are run with asgiref's `sync_to_async`, if available.
+
+"""
+from __future__ import unicode_literals
+import asyncio
+from inspect import getcallargs, isawaitable
+import time
+from .conf import conf
+from . import metrics
+from .variables import (get_tag, resolution_levels, resolve_levels,
+                        set_statements)
+
+try:
+    from asgiref.sync import async_to_sync, sync_to_async
+except ImportError:
+    # Django < 3.0
+    async_to_sync = sync_to_async = None
+
+try:
+    from asgiref.sync import markcoroutinefunction
+except ImportError:
+    # asgiref < 3.6
+    def markcoroutinefunction(obj):
+        obj._is_coroutine = asyncio.coroutines._is_coroutine
+        return obj
+
+
+def async_get_values(func, batch, params, tagpath):
+    """Makes `get_values` for a tag defined with `async def`."""
+    async def get_values(request, calls):
+        """Computes values for a list of (args, kwargs) pairs."""
+        if batch is None:
+            return list(await asyncio.gather(*[
+                func(request, *args, **kwargs) for args, kwargs in calls]))
+        arg_tuples = []
+        for args, kwargs in calls:
+            callargs = getcallargs(func, request, *args, **kwargs)
+            arg_tuples.append(tuple(callargs[p] for p in params[1:]))
+        values = batch(request, arg_tuples)
+        if isawaitable(values):
+            values = await values
+        values = list(values)
+        assert len(values) == len(calls), \
+            'Batch function for %s returned %d values for %d calls.' % (
+                tagpath, len(values), len(calls))
+        return values
+    return get_values
+
+
+async def _group_values(request, tagpath, calls):
+    tag = get_tag(tagpath)
+    labels = {'variable': tagpath}
+    with metrics.timed('variable_seconds', labels):
+        if tag.is_async:
+            values = await tag.get_values(request, calls)
+        elif sync_to_async is not None:
+            values = await sync_to_async(tag.get_values)(request, calls)
+        else:
+            values = tag.get_values(request, calls)
+    metrics.increment('variables_computed_total', len(calls), labels)
+    return values
+
+
+async def gather_values(request, groups):
+    """Computes groups of variables, as yielded by `resolve_levels`."""
+    tagpaths = list(groups)
+    values = await asyncio.gather(*[
+        _group_values(request, tagpath, groups[tagpath])
+        for tagpath in tagpaths])
+    return dict(zip(tagpaths, values))
+
+
+def run_gather_values(request, groups):
+    """Computes groups of variables from synchronous code."""
+    if async_to_sync is not None:
+        return async_to_sync(gather_values)(request, groups)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(gather_values(request, groups))
+    finally:
+        loop.close()
+
+
+async def aprovide_vars(request, ssi_vars, levels=None, values=None):
+    """Asynchronous version of `provide_vars`."""
+    collector = metrics.get_collector()
+    if collector is not None:
+        start = time.time()
+    if values is None:
+        values = {}
+    resolved = {}
+    if levels is None:
+        levels = resolution_levels(request, ssi_vars, values)
+
+    steps = resolve_levels(request, ssi_vars, levels, values, resolved)
+    try:
+        groups = next(steps)
+        while True:
+            groups = steps.send(await gather_values(request, groups))
+    except StopIteration:
+        pass
+
+    output = set_statements(request, resolved)
+    if collector is not None:
+        collector.observe('provide_vars_seconds', time.time() - start)
+        collector.observe('page_variables', len(resolved))
+    return output
+
+
+async def middleware_acall(middleware, request):
+    """Asynchronous version of `SsiMiddleware.__call__`."""
+    middleware.process_request(request)
+    response = await middleware.get_response(request)
+
+    if response.streaming or not getattr(response, 'is_rendered', True):
+        # Variables will be provided synchronously.
+        return middleware.process_response(request, response)
+
+    vars_needed, levels = middleware._vars_needed(request, response)
+    if vars_needed:
+        middleware._prepend_content(
+            response, await aprovide_vars(request, vars_needed, levels))
+    middleware._patch_headers(request, response, vars_needed)
+
+    if conf.RENDER:
+        from .middleware_debug import SsiRenderMiddleware
+        process_response = SsiRenderMiddleware().process_response
+        if sync_to_async is not None:
+            process_response = sync_to_async(process_response)
+            response = await process_response(request, response)
+        else:
+            response = process_response(request, response)
+    return response
@@ -2,43 +2,308 @@
 # This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
 # Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
 #
+"""
+Caches for the contents of SSI included views.
+
+The contents are stored in every cache listed in SSIFY_CACHE_ALIASES,
+or in the 'ssify' cache if it's configured, or in the 'default' one.
+
+Writes to multiple caches are done one after another by default.
+With SSIFY_CACHE_WRITE set to 'concurrent', they're done concurrently
+on a pool of SSIFY_CACHE_WRITE_THREADS threads, and with 'async',
+they're done in the background, without waiting for them to finish.
+
+Contents stored in caches listed in SSIFY_CACHE_COMPRESS are gzipped,
+if they're at least SSIFY_CACHE_COMPRESS_MIN_LENGTH bytes long, and
+decompressed transparently by `get_many_includes`. This is meant for
+caches only Django reads back (like a second-level cache behind
+a memcached nginx reads from): nginx can't include compressed entries,
+so the generated configuration never serves them. StaticFileBasedCache
+can't be compressed, use its GZIP_STATIC option instead.
+
+"""
 from __future__ import unicode_literals
-from django.core.cache import InvalidCacheBackendError
+import logging
+from multiprocessing.pool import ThreadPool
+from threading import local, Lock
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import NoReverseMatch, reverse
+from .cache_backends import StaticFileBasedCache
+from .compression import gzip_compress, gzip_decompress
 from .conf import conf
+from . import metrics
 
 
 DEFAULT_TIMEOUT = object()
 
+logger = logging.getLogger('ssify')
+
 
 try:
     from django.core.cache import caches
 except ImportError:
+    # Django < 1.7
     from django.core.cache import get_cache
 else:
-    get_cache = lambda alias: caches[alias]
+    def get_cache(alias):
+        """Returns the cache with the alias, for any Django version."""
+        return caches[alias]
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    # Django < 1.8
+    from django.test.signals import setting_changed
+
+
+_aliases = []
+# Cache instances aren't necessarily thread-safe, so every thread
+# gets its own list.
+_local = local()
+_pool = []
+_pool_lock = Lock()
+
+
+def get_cache_aliases():
+    """Returns the aliases of caches to use for includes."""
+    if not _aliases:
+        if conf.CACHE_ALIASES:
+            _aliases[:] = conf.CACHE_ALIASES
+        elif 'ssify' in settings.CACHES:
+            _aliases[:] = ['ssify']
+        else:
+            _aliases[:] = ['default']
+    return _aliases
+
+
+def _compressed_flags(aliases, caches):
+    """Tells which of the caches store compressed contents."""
+    compress = set(conf.CACHE_COMPRESS or ())
+    unknown = compress.difference(aliases)
+    if unknown:
+        raise ImproperlyConfigured(
+            'SSIFY_CACHE_COMPRESS lists caches not used for includes: '
+            '%s.' % ', '.join(sorted(unknown)))
+    for alias, cache in zip(aliases, caches):
+        if alias in compress and isinstance(cache, StaticFileBasedCache):
+            raise ImproperlyConfigured(
+                'StaticFileBasedCache can\'t be listed in '
+                'SSIFY_CACHE_COMPRESS, use its GZIP_STATIC option instead.')
+    return [alias in compress for alias in aliases]
 
 
 def get_caches():
+    """Returns the caches to use for includes, for the current thread."""
+    aliases = get_cache_aliases()
+    if getattr(_local, 'aliases', None) is not aliases:
+        caches = [get_cache(alias) for alias in aliases]
+        _local.compressed = _compressed_flags(aliases, caches)
+        _local.caches = caches
+        _local.aliases = aliases
+    return _local.caches
+
+
+def is_compressed_cache(i):
+    """Tells whether contents are compressed in the i-th cache."""
+    get_caches()
+    return _local.compressed[i]
+
+
+def _reset_caches(setting, **kwargs):
+    global _aliases
+    if setting in ('CACHES', 'SSIFY_CACHE_ALIASES', 'SSIFY_CACHE_COMPRESS'):
+        # New list, so that every thread knows to get new caches.
+        _aliases = []
+setting_changed.connect(_reset_caches)
+
+
+def _get_pool():
+    with _pool_lock:
+        if not _pool:
+            _pool.append(ThreadPool(conf.CACHE_WRITE_THREADS))
+        return _pool[0]
+
+
+def _compress(contents):
+    min_length = conf.CACHE_COMPRESS_MIN_LENGTH
+    level = conf.CACHE_COMPRESS_LEVEL
+    return dict(
+        (path, gzip_compress(content, level)
+         if len(content) >= min_length else content)
+        for path, content in contents.items())
+
+
+def _set_many(args):
+    """Writes the contents to a single cache."""
+    i, contents, timeout, version = args
+    cache = get_caches()[i]
+    if is_compressed_cache(i):
+        contents = _compress(contents)
+    kwargs = {'version': version}
+    if timeout is not DEFAULT_TIMEOUT:
+        kwargs['timeout'] = timeout
+    with metrics.timed('cache_write_seconds',
+                       {'cache': get_cache_aliases()[i]}):
+        if len(contents) == 1:
+            for path, content in contents.items():
+                cache.set(path, content, **kwargs)
+        else:
+            cache.set_many(contents, **kwargs)
+
+
+def _set_many_logged(args):
     try:
-        return [get_cache(c) for c in  conf.CACHE_ALIASES]
-    except:
+        _set_many(args)
+    except Exception:
+        logger.exception('Writing SSI includes to cache %s failed.',
+                         get_cache_aliases()[args[0]])
+
+
+def get_many_includes(paths, version=None):
+    """
+    Returns a dict of cached contents for the paths.
+
+    Every path is looked up in the caches in order, until found.
+
+    """
+    contents = {}
+    missing = list(paths)
+    for i, cache in enumerate(get_caches()):
+        if not missing:
+            break
+        found = cache.get_many(missing, version=version)
+        if found and is_compressed_cache(i):
+            found = dict((path, gzip_decompress(content))
+                         for path, content in found.items())
+        contents.update(found)
+        missing = [path for path in missing if path not in found]
+    return contents
+
+
+def set_many_includes(contents, timeout=DEFAULT_TIMEOUT, version=None):
+    """Stores the contents, a dict keyed by path, in all the caches."""
+    tasks = [(i, contents, timeout, version)
+             for i in range(len(get_caches()))]
+    mode = conf.CACHE_WRITE
+    if mode == 'async':
+        pool = _get_pool()
+        for task in tasks:
+            pool.apply_async(_set_many_logged, (task,))
+    elif mode == 'concurrent' and len(tasks) > 1:
+        _get_pool().map(_set_many, tasks)
+    else:
+        for task in tasks:
+            _set_many(task)
+
+
+def include_timeout(timeout=DEFAULT_TIMEOUT):
+    """
+    Returns the number of seconds the includes are kept in cache for,
+    or None if they don't expire.
+
+    With the default timeout, that's the longest default timeout
+    of the caches. StaticFileBasedCache never expires the contents.
+
+    """
+    if timeout is not DEFAULT_TIMEOUT:
+        return timeout
+    timeouts = [None if isinstance(cache, StaticFileBasedCache)
+                else cache.default_timeout for cache in get_caches()]
+    if None in timeouts:
+        return None
+    return max(timeouts)
+
+
+def cache_include(path, content, timeout=DEFAULT_TIMEOUT, version=None,
+                  tags=(), stale_timeout=None):
+    set_many_includes({path: content}, timeout=timeout, version=version)
+    registry.register([path], tags)
+    if stale_timeout is not None:
+        stale.store(path, content, include_timeout(timeout), stale_timeout,
+                    version)
+
+
+def view_paths(view, kwargs=None):
+    """
+    Returns paths of the view with kwargs, in all the languages.
+
+    If the URL pattern doesn't take `lang`, there's only one path.
+
+    """
+    kwargs = kwargs or {}
+    paths = set()
+    for lang, language_name in settings.LANGUAGES:
         try:
-            return [get_cache('ssify')]
-        except InvalidCacheBackendError:
-            return [get_cache('default')]
+            paths.add(reverse(view, kwargs=dict(kwargs, lang=lang)))
+        except NoReverseMatch:
+            break
+    if not paths:
+        paths.add(reverse(view, kwargs=kwargs))
+    return paths
 
 
-def cache_include(path, content, timeout=DEFAULT_TIMEOUT, version=None):
-    for cache in get_caches():
-        if timeout is DEFAULT_TIMEOUT:
-            cache.set(path, content, version=version)
-        else:
-            cache.set(path, content, timeout=timeout, version=version)
+def flush_ssi_includes(paths=None, prefix=None, view=None, kwargs=None,
+                       tags=None):
+    """
+    Removes included contents from the caches.
+
+    Without arguments, removes everything: if SSIFY_REGISTRY_CACHE
+    is set, all the registered includes are deleted, otherwise
+    the caches are cleared.
+
+    Otherwise, removes all the given paths, paths starting with prefix,
+    paths of the view with kwargs (in all the languages), and paths
+    registered with any of the tags. Flushing by prefix or tag needs
+    SSIFY_REGISTRY_CACHE, except for prefixes in StaticFileBasedCache.
+    Stale copies of the includes are removed as well.
 
+    """
+    everything = (paths is None and prefix is None and view is None and
+                  tags is None)
+    caches = get_caches()
+    static = [isinstance(cache, StaticFileBasedCache) for cache in caches]
+    if not registry.enabled() and (
+            tags or (prefix is not None and not all(static))):
+        raise ImproperlyConfigured(
+            'Flushing SSI includes by tag or prefix needs '
+            'SSIFY_REGISTRY_CACHE.')
 
-def flush_ssi_includes(paths=None):
-    for cache in get_caches():
-        if paths is None:
+    flush = set(paths or ())
+    if view is not None:
+        flush.update(view_paths(view, kwargs))
+    if tags:
+        flush.update(registry.tagged(tags))
+    if registry.enabled():
+        if everything:
+            flush.update(registry.all_paths())
+        elif prefix is not None:
+            flush.update(registry.with_prefix(prefix))
+
+    flushed = set(flush)
+    for cache, is_static in zip(caches, static):
+        if everything and (is_static or not registry.enabled()):
             cache.clear()
-        else:
-            cache.delete_many(paths)
+            continue
+        cache_flush = flush
+        if prefix is not None and is_static:
+            cache_flush = flush | set(
+                key for key in cache.keys() if key.startswith(prefix))
+        if cache_flush:
+            cache.delete_many(list(cache_flush))
+            flushed.update(cache_flush)
+
+    if everything and not registry.enabled():
+        stale.forget_all()
+    elif flushed:
+        stale.forget(flushed)
+
+    if registry.enabled():
+        if everything:
+            registry.clear()
+        elif tags:
+            registry.forget_tags(tags)
+
+
+# Imported last, as they use get_cache.
+from . import registry, stale
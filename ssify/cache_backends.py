@@ -3,26 +3,277 @@
 # Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
 #
 from __future__ import unicode_literals
+from contextlib import contextmanager
+import errno
+from hashlib import md5
 import os
+import tempfile
+from threading import Lock
+try:
+    import fcntl
+except ImportError:
+    # Not on POSIX, the index is left unlocked.
+    fcntl = None
+try:
+    from django.core.cache.backends.base import DEFAULT_TIMEOUT
+except ImportError:
+    # Django < 1.6
+    DEFAULT_TIMEOUT = None
 from django.core.cache.backends.filebased import FileBasedCache
+from .compression import gzip_compress
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Setting the umask is the only way to read it, and it's process-wide,
+# so it's only done once, on import, and not when other threads may be
+# creating files.
+_UMASK = _umask()
+
+
+def _makedirs(dirname):
+    """Creates the directory, if it doesn't already exist."""
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        # Some other process might have just created it.
+        if e.errno != errno.EEXIST or not os.path.isdir(dirname):
+            raise
 
 
 class StaticFileBasedCache(FileBasedCache):
-    def __init__(self, *args, **kwargs):
-        super(StaticFileBasedCache, self).__init__(*args, **kwargs)
+    """
+    Stores the contents as plain files, for the webserver to serve directly.
+
+    Files are written to a temporary file first, and then atomically
+    renamed, so the webserver never sees a half-written file.
+
+    Options:
+
+    FSYNC: if False (default), the data isn't explicitly synced to disk;
+        if 'file', the file is synced before the rename; if 'full',
+        the directory is also synced after the rename.
+    FILE_MODE: permissions for the files, by default determined
+        by the umask, like for normally created files.
+    LAYOUT: if 'path' (default), files are stored under their URL paths;
+        if 'hashed', they're stored as `ab/cd/abcd...` under the MD5
+        hash of the path, so that no directory gets too big.
+        See `nginx_config` for the matching webserver configuration.
+    INDEX: if True, the stored keys are listed in an index file,
+        so that listing and clearing the cache doesn't need to walk
+        the whole tree. Always on for the hashed layout.
+        Writers hold a shared `flock` on a lock file next to the index,
+        and `clear` and `compact_index` take it exclusively, so they
+        can run while the site is live. Without `fcntl` (not on POSIX)
+        there's no locking, and compaction must only be run offline.
+    GZIP_STATIC: if True, contents at least GZIP_MIN_LENGTH bytes long
+        (512 by default) are also written gzipped, to a `.gz` file next
+        to the plain one, for nginx's `gzip_static` to serve to clients
+        requesting the includes directly. SSI subrequests always get
+        the plain files.
+    GZIP_LEVEL: compression level of the `.gz` files, from 1 (fastest)
+        to 9 (smallest, default).
+
+    """
+    index_name = '.ssify-index'
+    lock_name = '.ssify-index.lock'
+
+    def __init__(self, dir, params):
+        super(StaticFileBasedCache, self).__init__(dir, params)
         self._dir = os.path.abspath(self._dir)
+        options = params.get('OPTIONS', {})
+        self._fsync = options.get('FSYNC', False)
+        assert self._fsync in (False, 'file', 'full'), \
+            'StaticFileBasedCache FSYNC option must be False, ' \
+            '\'file\' or \'full\'.'
+        self._file_mode = options.get('FILE_MODE', 0o666 & ~_UMASK)
+        self._layout = options.get('LAYOUT', 'path')
+        assert self._layout in ('path', 'hashed'), \
+            'StaticFileBasedCache LAYOUT option must be ' \
+            '\'path\' or \'hashed\'.'
+        self._index = options.get('INDEX', False) or self._layout == 'hashed'
+        self._index_path = os.path.join(self._dir, self.index_name)
+        self._lock_path = os.path.join(self._dir, self.lock_name)
+        # Keys already written to the index file by this process,
+        # and the generation of the index they were written to.
+        self._indexed = set()
+        self._index_generation = None
+        self._index_lock = Lock()
+        self._gzip_static = options.get('GZIP_STATIC', False)
+        self._gzip_min_length = options.get('GZIP_MIN_LENGTH', 512)
+        self._gzip_level = options.get('GZIP_LEVEL', 9)
+        assert 1 <= self._gzip_level <= 9, \
+            'StaticFileBasedCache GZIP_LEVEL option must be from 1 to 9.'
 
     def make_key(self, key, version=None):
         assert version is None, \
             'StaticFileBasedCache does not support versioning.'
         return key
 
-    def _key_to_file(self, key):
-        key = os.path.abspath(os.path.join(self._dir, key.lstrip('/')))
-        assert key.startswith(self._dir), 'Trying to save path outside root.'
+    def _key_to_file(self, key, version=None):
+        if self._layout == 'hashed':
+            digest = md5(key.encode('utf-8')).hexdigest()
+            return os.path.join(self._dir, digest[:2], digest[2:4], digest)
+        fname = os.path.abspath(os.path.join(self._dir, key.lstrip('/')))
+        assert fname.startswith(self._dir), \
+            'Trying to save path outside root.'
         if key.endswith('/'):
-            key += 'index.html'
-        return key
+            fname = os.path.join(fname, 'index.html')
+        return fname
+
+    def nginx_config(self, fallback):
+        """
+        Returns nginx configuration for serving the cached files.
+
+        Returns a pair of strings: directives for the `http` context,
+        and for the `location` context. The `fallback` is used in
+        `try_files` for the files which are not in cache.
+        The hashed layout needs `set_md5` from the ngx_set_misc module.
+
+        """
+        if self._layout == 'hashed':
+            http = (
+                "map $ssify_md5 $ssify_file {\n"
+                "    ~^(?<ssify_a>..)(?<ssify_b>..) "
+                "/$ssify_a/$ssify_b/$ssify_md5;\n"
+                "}\n")
+            location = (
+                "root %s;\n"
+                "set_md5 $ssify_md5 $uri;\n"
+                "try_files $ssify_file %s;\n" % (self._dir, fallback))
+        else:
+            http = ""
+            location = (
+                "root %s;\n"
+                "try_files $uri $uri/index.html %s;\n" % (
+                    self._dir, fallback))
+        if self._gzip_static:
+            location += "gzip_static on;\n"
+        return http, location
+
+    @contextmanager
+    def _locked_index(self, exclusive=False):
+        """
+        Locks the index, shared for writers or exclusive for rewriting it.
+
+        Yields the generation of the index, kept in the lock file
+        and bumped by every exclusive lock, so that writers know when
+        the index was cleared or compacted. Unlike the inode number
+        of the index, it's never reused.
+
+        """
+        _makedirs(self._dir)
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT,
+                     self._file_mode)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            generation = int(os.read(fd, 32) or 0)
+            if exclusive:
+                generation += 1
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, str(generation).encode('ascii'))
+            yield generation
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+    def _add_to_index(self, key, generation):
+        """
+        Appends the key to the index, unless it's already there.
+
+        Must be called with the index locked, with the generation
+        given by `_locked_index`.
+
+        """
+        with self._index_lock:
+            if generation != self._index_generation:
+                # The index has been cleared or compacted.
+                self._indexed.clear()
+                self._index_generation = generation
+            if key in self._indexed:
+                return
+            self._indexed.add(key)
+        # Short appends are atomic, so concurrent writers are fine.
+        with open(self._index_path, 'ab') as index:
+            index.write(key.encode('utf-8') + b'\n')
+
+    def keys(self):
+        """Returns all the keys stored in the cache."""
+        if self._index:
+            try:
+                with open(self._index_path, 'rb') as index:
+                    keys = set(line.decode('utf-8')
+                               for line in index.read().splitlines())
+            except (IOError, OSError):
+                return []
+            return sorted(key for key in keys
+                          if os.path.exists(self._key_to_file(key)))
+
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(self._dir):
+            prefix = os.path.relpath(dirpath, self._dir).replace(os.sep, '/')
+            prefix = '/' if prefix == '.' else '/%s/' % prefix
+            names = set(filenames)
+            for filename in filenames:
+                if filename.startswith('.'):
+                    # Index, lock or temporary file.
+                    continue
+                if filename.endswith('.gz') and filename[:-3] in names:
+                    # Precompressed copy.
+                    continue
+                if filename == 'index.html':
+                    keys.append(prefix)
+                else:
+                    keys.append(prefix + filename)
+        return sorted(keys)
+
+    def compact_index(self):
+        """Rewrites the index, leaving only the keys still in cache."""
+        if not self._index:
+            return
+        with self._locked_index(exclusive=True):
+            data = "".join(key + "\n" for key in self.keys()).encode('utf-8')
+            fd, tmp_path = tempfile.mkstemp(dir=self._dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as outf:
+                outf.write(data)
+            os.rename(tmp_path, self._index_path)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return os.path.exists(self._key_to_file(key))
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        fname = self._key_to_file(key)
+        try:
+            os.remove(fname)
+        except OSError:
+            pass
+        if self._gzip_static:
+            try:
+                os.remove(fname + '.gz')
+            except OSError:
+                pass
+
+    def clear(self):
+        if not self._index:
+            for key in self.keys():
+                self.delete(key)
+            return
+        with self._locked_index(exclusive=True):
+            for key in self.keys():
+                self.delete(key)
+            try:
+                os.remove(self._index_path)
+            except OSError:
+                pass
 
     def get(self, key, default=None, version=None):
         key = self.make_key(key, version=version)
@@ -35,17 +286,62 @@ class StaticFileBasedCache(FileBasedCache):
             pass
         return default
 
+    def _write(self, fname, data):
+        """Writes the file atomically. Raises IOError or OSError."""
+        dirname, basename = os.path.split(fname)
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=dirname, prefix='.%s.' % basename, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as outf:
+                outf.write(data)
+                if self._fsync:
+                    outf.flush()
+                    os.fsync(outf.fileno())
+            os.chmod(tmp_path, self._file_mode)
+            # Atomic on POSIX.
+            os.rename(tmp_path, fname)
+            tmp_path = None
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
     def set(self, key, value, timeout=None, version=None):
-        assert timeout is None, \
+        assert timeout is None or timeout is DEFAULT_TIMEOUT, \
             'StaticFileBasedCache does not support timeouts.'
         key = self.make_key(key, version=version)
         self.validate_key(key)
         fname = self._key_to_file(key)
         dirname = os.path.dirname(fname)
         try:
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            with open(fname, 'wb') as outf:
-                outf.write(value)
+            _makedirs(dirname)
+            if self._gzip_static:
+                # The compressed copy goes first, so that it's never
+                # older than the plain file.
+                if len(value) >= self._gzip_min_length:
+                    self._write(fname + '.gz',
+                                gzip_compress(value, self._gzip_level))
+                else:
+                    try:
+                        os.remove(fname + '.gz')
+                    except OSError:
+                        pass
+            if self._index:
+                # The file is written under the lock too, so that
+                # compaction doesn't drop the key before it exists.
+                with self._locked_index() as generation:
+                    self._add_to_index(key, generation)
+                    self._write(fname, value)
+            else:
+                self._write(fname, value)
+            if self._fsync == 'full':
+                dir_fd = os.open(dirname, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
         except (IOError, OSError):
             pass
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Gzip compression of included contents.
+
+Contents are compressed in the gzip format, so that the same data can be
+stored in a cache, or written next to a static file for nginx's
+`gzip_static`. The gzip magic number tells compressed contents apart
+from plain HTML, so plain entries written before compression was turned
+on are still read correctly.
+
+"""
+from __future__ import unicode_literals
+import zlib
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+# Tells zlib to use the gzip header and trailer.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def gzip_compress(data, level=6):
+    """Compresses bytes in the gzip format."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def is_compressed(data):
+    return data[:2] == GZIP_MAGIC
+
+
+def gzip_decompress(data):
+    """Decompresses gzip-compressed bytes, and passes other data through."""
+    if not is_compressed(data):
+        return data
+    return zlib.decompress(data, _GZIP_WBITS)
@@ -15,8 +15,30 @@ class AppSettings(object):
 
 
 AppSettings.add('CACHE_ALIASES', None)
+AppSettings.add('CACHE_COMPRESS', None)
+AppSettings.add('CACHE_COMPRESS_LEVEL', 6)
+AppSettings.add('CACHE_COMPRESS_MIN_LENGTH', 512)
+AppSettings.add('CACHE_WRITE', 'serial')
+AppSettings.add('CACHE_WRITE_THREADS', 4)
+AppSettings.add('METRICS_COLLECTOR', None)
+AppSettings.add('METRICS_STATSD_HOST', 'localhost')
+AppSettings.add('METRICS_STATSD_PORT', 8125)
+AppSettings.add('REGISTRY_CACHE', None)
+AppSettings.add('REGISTRY_TIMEOUT', None)
 AppSettings.add('RENDER', False)
 AppSettings.add('RENDER_VERBOSE', False)
+AppSettings.add('RENDER_THREADS', 8)
+AppSettings.add('SHARED_VALUES_MAX_ENTRIES', 1000)
+AppSettings.add('SSI_VALUE_LENGTH', 256)
+AppSettings.add('SSI_VALUE_TOO_LONG', 'truncate')
+AppSettings.add('STALE_CACHE', 'default')
+AppSettings.add('STALE_LOCK_TIMEOUT', 30)
+AppSettings.add('VARIABLE_NAME_DIGEST', 'md5')
+AppSettings.add('VARIABLE_NAMES_MAX_ENTRIES', 10000)
+AppSettings.add('VARIABLE_THREADS', None)
+AppSettings.add('VARS_MANIFEST_CACHE', None)
+AppSettings.add('VARS_MANIFEST_TIMEOUT', None)
+AppSettings.add('VARS_PLANS_MAX_ENTRIES', 1000)
 
 
 conf = AppSettings()
@@ -7,20 +7,27 @@ Defines decorators for use in ssify-enabled projects.
 """
 from __future__ import unicode_literals
 import functools
-from inspect import getargspec
+from inspect import getargspec, getcallargs
+try:
+    from inspect import iscoroutinefunction
+except ImportError:
+    # Python < 3.5
+    iscoroutinefunction = lambda func: False
 import warnings
 from django.conf import settings
-from django.http import Http404
+from django.http import Http404, HttpResponse
 from django.template.base import parse_bits
 from django.utils.translation import get_language, activate
 from .cache import cache_include, DEFAULT_TIMEOUT
-from . import exceptions
+from .dependencies import ssi_depends_on
+from . import exceptions, stale
 from .variables import SsiVariable
 
 
 def ssi_included(view=None, use_lang=True,
         timeout=DEFAULT_TIMEOUT, version=None,
-        get_ssi_vars=None, patch_response=None):
+        get_ssi_vars=None, patch_response=None, tags=None, depends_on=None,
+        stale_timeout=None, warm_kwargs=None):
     """
     Marks a view to be used as a snippet to be included with SSI.
 
@@ -32,6 +39,25 @@ def ssi_included(view=None, use_lang=True,
     get_ssi_vars should be a callable which takes the view's arguments
     and returns the names of SSI variables it uses.
 
+    tags can be a list of strings, or a callable which takes the view's
+    arguments and returns such a list. The cached contents can then be
+    flushed by tag, using `flush_ssi_includes`.
+
+    depends_on can be a callable which takes the view's arguments and
+    returns model instances, querysets or models the contents depend on.
+    Dependencies can also be recorded inside the view, using
+    `ssi_depends_on`. When SSIFY_REGISTRY_CACHE is set, the cached
+    contents are flushed whenever any of them is saved or deleted.
+
+    If stale_timeout is given, a copy of the contents is kept for that
+    many seconds after they expire. When the include is requested
+    again, only one request renders the view, while the others get
+    the stale copy (see `ssify.stale`).
+
+    warm_kwargs can be a callable returning an iterable of the view's
+    keyword arguments (without lang), to render with the `ssify_warm`
+    management command.
+
     """
     def dec(view):
         @functools.wraps(view)
@@ -46,45 +72,76 @@ def ssi_included(view=None, use_lang=True,
                 current_lang = get_language()
                 activate(lang)
                 request.LANGUAGE_CODE = lang
-            response = view(request, *args, **kwargs)
-            if use_lang:
-                activate(current_lang)
-            if response.status_code == 200:
-                # We don't want this view to be cached in
-                # UpdateCacheMiddleware. We'll just cache the contents
-                # ourselves, and point the webserver to use this cache.
-                request._cache_update_cache = False
-
-                def _check_included_vars(response):
-                    used_vars = request.ssi_vars_needed
-                    if get_ssi_vars:
-                        # Remove the ssi vars that should be provided
-                        # by the including view.
-                        pass_vars = get_ssi_vars(*args, **kwargs)
-
-                        for var in pass_vars:
-                            if not isinstance(var, SsiVariable):
-                                var = SsiVariable(*var)
-                            try:
-                                del used_vars[var.name]
-                            except KeyError:
-                                warnings.warn(
-                                    exceptions.UnusedSsiVarsWarning(
-                                        request, var))
-                    if used_vars:
-                        raise exceptions.UndeclaredSsiVarsError(
-                            request, used_vars)
-                    request.ssi_vars_needed = {}
-
-                    # Don't use default django response caching for this view,
-                    # just save the contents instead.
-                    cache_include(request.path, response.content,
-                        timeout=timeout, version=version)
-
-                if hasattr(response, 'render') and callable(response.render):
-                    response.add_post_render_callback(_check_included_vars)
+            request.ssi_include_tags = set()
+            locked = stale_content = None
+            if stale_timeout is not None:
+                locked = stale.acquire(request.path, version)
+                if not locked:
+                    stale_content = stale.get(request.path, version)
+            try:
+                if stale_content is not None:
+                    # Someone else is rendering it already.
+                    request._cache_update_cache = False
+                    response = HttpResponse(stale_content)
                 else:
-                    _check_included_vars(response)
+                    response = view(request, *args, **kwargs)
+                if use_lang:
+                    activate(current_lang)
+                if stale_content is None and response.status_code == 200:
+                    # We don't want this view to be cached in
+                    # UpdateCacheMiddleware. We'll just cache the contents
+                    # ourselves, and point the webserver to use this cache.
+                    request._cache_update_cache = False
+
+                    def _check_included_vars(response):
+                        used_vars = request.ssi_vars_needed
+                        if get_ssi_vars:
+                            # Remove the ssi vars that should be provided
+                            # by the including view.
+                            pass_vars = get_ssi_vars(*args, **kwargs)
+
+                            for var in pass_vars:
+                                if not isinstance(var, SsiVariable):
+                                    var = SsiVariable(*var)
+                                try:
+                                    del used_vars[var.name]
+                                except KeyError:
+                                    warnings.warn(
+                                        exceptions.UnusedSsiVarsWarning(
+                                            request, var))
+                        if used_vars:
+                            raise exceptions.UndeclaredSsiVarsError(
+                                request, used_vars)
+                        request.ssi_vars_needed = {}
+
+                        # Don't use default django response caching
+                        # for this view, just save the contents instead.
+                        if callable(tags):
+                            view_tags = tags(*args, **kwargs)
+                        else:
+                            view_tags = tags or ()
+                        view_tags = request.ssi_include_tags.union(view_tags)
+                        if depends_on:
+                            ssi_depends_on(
+                                request, *depends_on(*args, **kwargs))
+                            view_tags.update(request.ssi_include_tags)
+                        cache_include(request.path, response.content,
+                            timeout=timeout, version=version, tags=view_tags,
+                            stale_timeout=stale_timeout)
+
+                    if (hasattr(response, 'render') and
+                            callable(response.render)):
+                        response.add_post_render_callback(
+                            _check_included_vars)
+                        if locked:
+                            # Render it now, while holding the lock,
+                            # so it's released even if rendering fails.
+                            response.render()
+                    else:
+                        _check_included_vars(response)
+            finally:
+                if locked:
+                    stale.release(request.path, version)
 
             return response
 
@@ -92,11 +149,13 @@ def ssi_included(view=None, use_lang=True,
         # by including view.
         new_view.get_ssi_vars = get_ssi_vars
         new_view.ssi_patch_response = patch_response
+        new_view.warm_kwargs = warm_kwargs
         return new_view
     return dec(view) if view else dec
 
 
-def ssi_variable(register, name=None, patch_response=None):
+def ssi_variable(register, name=None, patch_response=None, batch=None,
+        shared_timeout=None, thread_safe=True):
     """
     Creates a template tag representing an SSI variable from a function.
 
@@ -104,6 +163,27 @@ def ssi_variable(register, name=None, patch_response=None):
     It may take other arguments, which should be provided when using
     the template tag.
 
+    If batch is given, it should be a function taking the request
+    and a list of argument tuples (without the request), and returning
+    a list of values for all of them, in the same order. It will be used
+    to compute all the needed variables of this kind at once.
+
+    If shared_timeout is given, the variable is assumed not to depend
+    on the user, and its values are reused across requests for that many
+    seconds.
+
+    The function (and the batch function) can be defined with `async def`.
+    Values of such variables not depending on each other are computed
+    concurrently.
+
+    If SSIFY_VARIABLE_THREADS is set, values of variables are computed
+    on a pool of threads. Pass thread_safe=False for functions which
+    can't be called from another thread, or concurrently. Note that
+    the threads share the request, and lazy attributes like
+    `request.user` and `request.session` are not safe to evaluate
+    concurrently: functions using them need thread_safe=False, unless
+    the attributes are always evaluated before (e.g. by a middleware).
+
     """
     # Cache control?
     def dec(func):
@@ -118,6 +198,9 @@ def ssi_variable(register, name=None, patch_response=None):
         assert params and params[0] == 'request', '%s is decorated with '\
             'request_info_tag, so it must take `request` for '\
             'its first argument.' % (tagpath)
+        assert batch is None or (varargs is None and varkw is None), \
+            '%s has a batch function, so it can\'t take variable '\
+            'arguments.' % (tagpath)
 
         @register.tag(name=function_name)
         def _ssi_var_tag(parser, token):
@@ -152,6 +235,29 @@ def ssi_variable(register, name=None, patch_response=None):
                                       name=function_name)
             return SsiVariableNode(tagpath, args, kwargs, patch_response, asvar)
         _ssi_var_tag.get_value = func
+        _ssi_var_tag.is_async = iscoroutinefunction(func)
+
+        def get_values(request, calls):
+            """Computes values for a list of (args, kwargs) pairs."""
+            if batch is None:
+                return [func(request, *args, **kwargs)
+                        for args, kwargs in calls]
+            arg_tuples = []
+            for args, kwargs in calls:
+                callargs = getcallargs(func, request, *args, **kwargs)
+                arg_tuples.append(tuple(callargs[p] for p in params[1:]))
+            values = list(batch(request, arg_tuples))
+            assert len(values) == len(calls), \
+                'Batch function for %s returned %d values for %d calls.' % (
+                    tagpath, len(values), len(calls))
+            return values
+        if _ssi_var_tag.is_async:
+            from .asynchronous import async_get_values
+            get_values = async_get_values(func, batch, params, tagpath)
+        _ssi_var_tag.get_values = get_values
+        _ssi_var_tag.shared_timeout = shared_timeout
+        _ssi_var_tag.batch = batch
+        _ssi_var_tag.thread_safe = thread_safe
         #return _ssi_var_tag
         return func
 
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Model-driven invalidation of cached includes.
+
+An `ssi_included` view can declare the model instances, querysets
+or models its contents depend on, with its `depends_on` argument,
+or record them while rendering with `ssi_depends_on`. They're stored
+as tags in the registry (see `ssify.registry`), and whenever a model
+instance is saved or deleted, only the includes depending on it,
+or on its model as a whole, are flushed.
+
+Models which have any dependants are marked in the registry, so that
+saving or deleting instances of other models (sessions, users, etc.)
+costs at most a single cache lookup, in every process. The mark is
+refreshed whenever a dependant is rendered, and always looked up
+in the registry, so that it's never lost to an eviction there
+while some process believes it's still set.
+
+"""
+from __future__ import unicode_literals
+from django.db.models import Model
+from django.db.models.query import QuerySet
+from django.db.models.signals import post_delete, post_save
+from . import registry
+
+
+def _model_label(model):
+    opts = getattr(model._meta, 'concrete_model', model)._meta
+    return '%s.%s' % (opts.app_label, opts.object_name.lower())
+
+
+def dependency_model(obj):
+    """Returns the model of a model instance, queryset or model."""
+    if isinstance(obj, Model):
+        return type(obj)
+    elif isinstance(obj, QuerySet):
+        return obj.model
+    elif isinstance(obj, type) and issubclass(obj, Model):
+        return obj
+    raise TypeError('%r is not a model instance, queryset or model.' % obj)
+
+
+def dependency_tags(obj):
+    """
+    Returns the tags for a model instance, queryset or model.
+
+    A model instance is tagged by its primary key, querysets and models
+    are tagged as depending on any instance of the model.
+
+    """
+    label = _model_label(dependency_model(obj))
+    if isinstance(obj, Model):
+        return ['model:%s:%s' % (label, obj.pk)]
+    return ['model:%s' % label]
+
+
+def ssi_depends_on(request, *objects):
+    """
+    Records the dependencies of the `ssi_included` view being rendered.
+
+    Objects can be model instances, querysets or models.
+
+    """
+    tags = getattr(request, 'ssi_include_tags', None)
+    if tags is not None:
+        labels = set()
+        for obj in objects:
+            tags.update(dependency_tags(obj))
+            labels.add(_model_label(dependency_model(obj)))
+        if registry.enabled():
+            for label in labels:
+                registry.mark_model(label)
+
+
+def flush_dependants(sender, instance, **kwargs):
+    """Flushes the includes depending on a saved or deleted instance."""
+    if not registry.enabled() or not registry.is_model_marked(
+            _model_label(type(instance))):
+        return
+    flush_ssi_includes(
+        tags=dependency_tags(instance) + dependency_tags(type(instance)))
+
+
+post_save.connect(flush_dependants,
+                  dispatch_uid='ssify.dependencies.flush_dependants')
+post_delete.connect(flush_dependants,
+                    dispatch_uid='ssify.dependencies.flush_dependants')
+
+
+from .cache import flush_ssi_includes
@@ -83,16 +83,66 @@ class NoLangFieldError(SsifyError):
 class SsiVarsDependencyCycleError(SsifyError):
     """Looks like there's a dependency cycle in the SSI variables.
 
-    Yet to find an example of a configuration that triggers that.
+    Since variable names are hashes of their definitions, this shouldn't
+    happen unless the names were tampered with.
     """
 
-    def __init__(self, request, ssi_vars, resolved):
+    def __init__(self, request, ssi_vars, resolved, cycle):
         super(SsiVarsDependencyCycleError, self).__init__(
-            request, ssi_vars, resolved)
+            request, ssi_vars, resolved, cycle)
 
     def __str__(self):
-        return "The view '%s' at '%s' has dependency cycle. "\
+        return "The view '%s' at '%s' has dependency cycle: %s. "\
             "Unresolved SSI variables:\n%s\n\n"\
             "Resolved SSI variables:\n%s." % (
                 self.view_path(), self.request.get_full_path(),
-                self.args[0], self.args[1])
+                " -> ".join(self.args[2]), self.args[0], self.args[1])
+
+
+@python_2_unicode_compatible
+class SsiVarsDependencyMissingError(SsifyError):
+    """Some SSI variables depend on variables which are not provided."""
+
+    def __init__(self, request, missing):
+        super(SsiVarsDependencyMissingError, self).__init__(request, missing)
+
+    def __str__(self):
+        return "The view '%s' at '%s' uses SSI variables depending "\
+            "on variables it doesn't provide: %s. " % (
+                self.view_path(), self.request.get_full_path(),
+                repr(self.args[0]))
+
+
+@python_2_unicode_compatible
+class SsiVarsManifestMissingError(SsifyError):
+    """A cached response refers to a manifest which is not in the cache."""
+
+    def __init__(self, request, manifest_id):
+        super(SsiVarsManifestMissingError, self).__init__(
+            request, manifest_id)
+
+    def __str__(self):
+        return "The cached response for '%s' needs SSI variables "\
+            "from manifest '%s', but it's not in the cache "\
+            "(SSIFY_VARS_MANIFEST_CACHE). " % (
+                self.request.get_full_path(), self.args[0])
+
+
+@python_2_unicode_compatible
+class SsiValueTooLongError(SsifyError):
+    """A value of an SSI variable is longer than nginx will accept."""
+
+    def __init__(self, request, name, value, length, limit):
+        super(SsiValueTooLongError, self).__init__(
+            request, name, value, length, limit)
+
+    def __str__(self):
+        return "The view '%s' at '%s' provides SSI variable %s with "\
+            "a value of %d bytes (as nginx counts it), longer than "\
+            "SSIFY_SSI_VALUE_LENGTH=%d, so nginx would refuse it. "\
+            "Increase ssi_value_length in nginx configuration along "\
+            "with SSIFY_SSI_VALUE_LENGTH, or make the value shorter. "\
+            "The value starts with: %r. " % (
+                self.view_path(), self.request.get_full_path(),
+                self.args[0], self.args[2], self.args[3],
+                self.args[1][:50])
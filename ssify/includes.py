@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+SSI include statements for URLs of `ssi_included` views.
+
+The first time an URL name is included with a set of keyword
+arguments, it's found out whether the URL pattern takes `lang`, and
+which view it leads to. This plan is kept for the process, so
+including it again only needs the URL to be reversed.
+
+`ssi_include_statements` includes the same view many times at once,
+preparing the URL pattern and registering the decorators only once.
+
+"""
+from __future__ import unicode_literals
+from collections import namedtuple
+from threading import Lock
+from django.conf import settings
+from django.core.urlresolvers import (NoReverseMatch, get_urlconf, resolve,
+                                      reverse)
+from django.utils.translation import get_language
+from . import metrics
+from .variables import SsiVariable
+
+
+IncludePlan = namedtuple('IncludePlan',
+                         'takes_lang get_ssi_vars patch_response')
+
+_plans = {}
+_plans_lock = Lock()
+
+
+def _placeholders(kwargs):
+    """
+    Replaces SSI variables in kwargs with numeric placeholders.
+
+    Returns the new kwargs, and a dict of variables by placeholder.
+
+    """
+    b_kwargs = {}
+    subst = {}
+    for k, value in kwargs.items():
+        if isinstance(value, SsiVariable):
+            numstr = '%04d' % len(subst)
+            b_kwargs[k] = numstr
+            subst[numstr] = value
+        else:
+            b_kwargs[k] = value
+    return b_kwargs, subst
+
+
+def _with_lang(b_kwargs):
+    """Adds current language to kwargs, unless given explicitly."""
+    lang_kwargs = {'lang': get_language()}
+    lang_kwargs.update(b_kwargs)
+    return lang_kwargs
+
+
+def _reverse(plan, name, b_kwargs):
+    if plan.takes_lang:
+        b_kwargs = _with_lang(b_kwargs)
+    return reverse(name, kwargs=b_kwargs)
+
+
+def include_plan(name, b_kwargs):
+    """
+    Returns the include plan and URL for the URL name and kwargs.
+
+    Raises NoReverseMatch if the URL can't be reversed.
+
+    """
+    key = (get_urlconf() or settings.ROOT_URLCONF, name,
+           frozenset(b_kwargs))
+    plan = _plans.get(key)
+    if plan is not None:
+        return plan, _reverse(plan, name, b_kwargs)
+
+    try:
+        url = reverse(name, kwargs=_with_lang(b_kwargs))
+        takes_lang = True
+    except NoReverseMatch:
+        url = reverse(name, kwargs=b_kwargs)
+        takes_lang = False
+    view = resolve(url).func
+    plan = IncludePlan(
+        takes_lang,
+        getattr(view, 'get_ssi_vars', None),
+        getattr(view, 'ssi_patch_response', None))
+    with _plans_lock:
+        _plans[key] = plan
+    return plan, url
+
+
+def ssi_include_statements(request, name, kwargs_list):
+    """
+    Returns a list of SSI include statements for the URL name,
+    one for every dict of kwargs.
+
+    Any SSI variables the included views declare as needed are
+    remembered in the request, along with the decorators to use on
+    the including view.
+
+    """
+    statements = []
+    plans = {}
+    needed = request.ssi_vars_needed
+    for kwargs in kwargs_list:
+        b_kwargs, subst = _placeholders(kwargs)
+        plan = plans.get(frozenset(b_kwargs))
+        if plan is None:
+            plan, url = include_plan(name, b_kwargs)
+            plans[frozenset(b_kwargs)] = plan
+        else:
+            url = _reverse(plan, name, b_kwargs)
+
+        for numstr, orig in subst.items():
+            url = url.replace(numstr, orig.as_var())
+
+        # Remember the SSI vars the included view says it needs.
+        if plan.get_ssi_vars:
+            for var in plan.get_ssi_vars(**kwargs):
+                if not isinstance(var, SsiVariable):
+                    var = SsiVariable(*var)
+                needed[var.name] = var
+
+        statements.append("<!--#include file='%s'-->" % url)
+
+    # Remember the decorators to use on the including view.
+    # All the plans are for the same view.
+    for plan in plans.values():
+        if plan.patch_response:
+            for patch in plan.patch_response:
+                if patch not in request.ssi_patch_response:
+                    request.ssi_patch_response.append(patch)
+            break
+    metrics.increment('includes_total', len(statements), {'view': name})
+    return statements
+
+
+def ssi_include_statement(request, name, kwargs):
+    """Returns an SSI include statement for the URL name and kwargs."""
+    return ssi_include_statements(request, name, [kwargs])[0]
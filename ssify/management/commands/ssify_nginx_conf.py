@@ -5,12 +5,22 @@
 from __future__ import unicode_literals
 from optparse import make_option
 from django.core.management.base import BaseCommand
+from ssify.nginx import nginx_config
 
 
 class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
+        make_option('--upstream', dest='upstream', default='127.0.0.1:8000',
+                    help='Address of the Django application server.'),
+        make_option('--listen', dest='listen', default='80',
+                    help='Address and/or port for nginx to listen on.'),
+        make_option('--server-name', dest='server_name', default=None,
+                    help='Server names (default: from ALLOWED_HOSTS).'),
     )
     help = 'Dumps configuration for NGINX.'
 
     def handle(self, **options):
-        pass
+        self.stdout.write(nginx_config(
+            options.get('upstream', '127.0.0.1:8000'),
+            listen=options.get('listen', '80'),
+            server_name=options.get('server_name')), ending='')
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+from multiprocessing import cpu_count, Pool
+from optparse import make_option
+import os
+import time
+from django.core.management.base import BaseCommand
+from ssify.cache import get_many_includes
+from ssify.warm import (close_connections, init_worker, render_path,
+                        warm_paths)
+
+
+def _unique(paths, done):
+    for path in paths:
+        if path not in done:
+            done.add(path)
+            yield path
+
+
+def _missing(paths, batch_size=100):
+    """Skips the paths which are already cached."""
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == batch_size:
+            cached = get_many_includes(batch)
+            for batch_path in batch:
+                if batch_path not in cached:
+                    yield batch_path
+            batch = []
+    cached = get_many_includes(batch) if batch else {}
+    for batch_path in batch:
+        if batch_path not in cached:
+            yield batch_path
+
+
+def _throttled(paths, rate):
+    """Yields at most `rate` paths per second."""
+    interval = 1.0 / rate
+    next_time = time.time()
+    for path in paths:
+        delay = next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        next_time = max(next_time, time.time()) + interval
+        yield path
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+                    default=cpu_count(),
+                    help='Number of rendering processes.'),
+        make_option('--rate', type='float', dest='rate', default=None,
+                    help='Maximum number of paths rendered per second.'),
+        make_option('--state', dest='state', default=None,
+                    help='File keeping the rendered paths, for resuming.'),
+        make_option('--missing', action='store_true', dest='missing',
+                    default=False,
+                    help='Only render the paths missing in the caches.'),
+        make_option('--host', dest='host', default=None,
+                    help='Host name for the requests.'),
+    )
+    help = 'Renders SSI included views into the caches.'
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        done = set()
+        state = options.get('state')
+        if state and os.path.exists(state):
+            with open(state) as state_file:
+                done.update(line.rstrip('\n') for line in state_file)
+
+        paths = _unique(warm_paths(), done)
+        if options.get('missing'):
+            paths = _missing(paths)
+        if options.get('rate'):
+            paths = _throttled(paths, options['rate'])
+
+        pool = None
+        if options.get('processes', 1) > 1:
+            close_connections()
+            pool = Pool(options['processes'], init_worker,
+                        (options.get('host'),))
+            results = pool.imap_unordered(render_path, paths)
+        else:
+            init_worker(options.get('host'))
+            results = (render_path(path) for path in paths)
+
+        state_file = open(state, 'a') if state else None
+        rendered = failed = 0
+        try:
+            for path, status_code in results:
+                if status_code == 200:
+                    rendered += 1
+                    if state_file is not None:
+                        state_file.write(path + '\n')
+                        state_file.flush()
+                    if verbosity > 1:
+                        self.stdout.write(path)
+                else:
+                    failed += 1
+                    self.stderr.write('%s: %d' % (path, status_code))
+        finally:
+            if state_file is not None:
+                state_file.close()
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+        if verbosity:
+            self.stdout.write('Rendered %d paths, %d failed.' % (
+                rendered, failed))
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Manifests of SSI variables needed by cached responses.
+
+PrepareForCacheMiddleware stores the definitions of all the needed
+variables with the response. By default, they're stored as JSON in the
+X-Ssi-Vars-Needed header. If SSIFY_VARS_MANIFEST_CACHE is set to a cache
+alias, the JSON is stored in that cache instead, and the response only
+gets its content-addressed ID in the X-Ssi-Vars-Manifest header.
+
+On a cache hit, SsiMiddleware needs a plan: the decoded variables,
+ordered by their dependencies. Plans are kept in a process-local LRU
+cache, so for most hits there's no JSON decoding and no dependency
+resolution.
+
+Manifests are kept twice as long as the pages referring to them,
+unless SSIFY_VARS_MANIFEST_TIMEOUT is set. A manifest can still be
+evicted from its cache before the page. SsiMiddleware then serves
+the page without the SSI variables, and marks it as not cacheable.
+
+"""
+from __future__ import unicode_literals
+from collections import OrderedDict
+from hashlib import md5
+from threading import Lock
+from django.conf import settings
+from django.utils.cache import get_max_age
+from .cache import get_cache
+from .conf import conf
+from .exceptions import SsiVarsManifestMissingError
+from .serializers import json_decode, json_encode
+from .variables import SsiVariable, resolution_levels
+
+
+VARS_HEADER = 'X-Ssi-Vars-Needed'
+MANIFEST_HEADER = 'X-Ssi-Vars-Manifest'
+MANIFEST_KEY = 'ssify:manifest:%s'
+
+
+class PlanCache(object):
+    """
+    Thread-safe LRU cache of plans, with hit/miss counters.
+
+    Keeps at most SSIFY_VARS_PLANS_MAX_ENTRIES plans.
+
+    """
+    def __init__(self):
+        self._plans = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                plan = self._plans.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._plans[key] = plan
+            self.hits += 1
+            return plan
+
+    def set(self, key, plan):
+        with self._lock:
+            self._plans.pop(key, None)
+            while len(self._plans) >= conf.VARS_PLANS_MAX_ENTRIES:
+                self._plans.popitem(last=False)
+            self._plans[key] = plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+plans = PlanCache()
+
+
+def manifest_id(data):
+    """Manifest ID is a hash of its contents."""
+    return md5(data.encode('ascii')).hexdigest()
+
+
+def manifest_timeout(response):
+    """
+    Returns the number of seconds to keep the manifest for.
+
+    That's twice as long as the cache middleware keeps the page,
+    so that the manifest doesn't expire first.
+
+    """
+    if conf.VARS_MANIFEST_TIMEOUT is not None:
+        return conf.VARS_MANIFEST_TIMEOUT
+    page_timeout = get_max_age(response)
+    if page_timeout is None:
+        page_timeout = settings.CACHE_MIDDLEWARE_SECONDS
+    return 2 * page_timeout
+
+
+def add_manifest(response, ssi_vars):
+    """Stores the definitions of needed SSI variables with the response."""
+    data = json_encode(
+        dict((k, v.definition) for (k, v) in ssi_vars.items()),
+        sort_keys=True)
+    if conf.VARS_MANIFEST_CACHE:
+        key = manifest_id(data)
+        get_cache(conf.VARS_MANIFEST_CACHE).set(
+            MANIFEST_KEY % key, data, timeout=manifest_timeout(response))
+        response[MANIFEST_HEADER] = key
+    else:
+        response[VARS_HEADER] = data
+
+
+def has_manifest(response):
+    return MANIFEST_HEADER in response or VARS_HEADER in response
+
+
+def get_plan(request, response):
+    """
+    Returns the variables needed by a cached response, and their order.
+
+    The order is a list of levels, as returned by `resolution_levels`.
+
+    """
+    if MANIFEST_HEADER in response:
+        key = response[MANIFEST_HEADER]
+    elif VARS_HEADER in response:
+        # The JSON itself is a good enough key.
+        key = response[VARS_HEADER]
+    else:
+        return {}, []
+
+    plan = plans.get(key)
+    if plan is None:
+        if MANIFEST_HEADER in response:
+            data = get_cache(conf.VARS_MANIFEST_CACHE).get(MANIFEST_KEY % key)
+            if data is None:
+                raise SsiVarsManifestMissingError(request, key)
+        else:
+            data = key
+        ssi_vars = json_decode(data)
+        for k, v in ssi_vars.items():
+            ssi_vars[k] = SsiVariable(*v)
+        plan = ssi_vars, resolution_levels(request, ssi_vars)
+        plans.set(key, plan)
+    return plan
+
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Memoization of computed SSI variable values.
+
+Every request gets its own memo, so that a variable used by the view
+and by any included views rendered in the same request is only computed
+once.
+
+Values of variables declared with `shared_timeout` in `ssi_variable`
+are also kept in a process-wide memo for that many seconds, and reused
+across requests.
+
+Both memos count their hits and misses.
+
+"""
+from __future__ import unicode_literals
+from threading import Lock
+from time import time
+from .conf import conf
+
+
+NOT_FOUND = object()
+
+
+class ValuesMemo(object):
+    """Memo of SSI variable values, keyed by variable name."""
+
+    def __init__(self):
+        self._values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        """Returns the memoized value, or NOT_FOUND."""
+        value = self._values.get(name, NOT_FOUND)
+        if value is NOT_FOUND:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, name, value):
+        self._values[name] = value
+
+    def clear(self):
+        self._values.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class SharedValuesMemo(ValuesMemo):
+    """
+    Thread-safe memo of SSI variable values, with timeouts.
+
+    Keeps at most SSIFY_SHARED_VALUES_MAX_ENTRIES values. When full,
+    the expired values are dropped, and if that's not enough,
+    the memo is cleared.
+
+    """
+    def __init__(self):
+        super(SharedValuesMemo, self).__init__()
+        self._lock = Lock()
+
+    def get(self, name):
+        with self._lock:
+            value, expires = self._values.get(name, (NOT_FOUND, None))
+            if value is not NOT_FOUND and expires <= time():
+                del self._values[name]
+                value = NOT_FOUND
+            if value is NOT_FOUND:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, name, value, timeout):
+        now = time()
+        with self._lock:
+            if (name not in self._values and
+                    len(self._values) >= conf.SHARED_VALUES_MAX_ENTRIES):
+                for key, (v, expires) in list(self._values.items()):
+                    if expires <= now:
+                        del self._values[key]
+                if len(self._values) >= conf.SHARED_VALUES_MAX_ENTRIES:
+                    self._values.clear()
+            self._values[name] = (value, now + timeout)
+
+    def clear(self):
+        with self._lock:
+            super(SharedValuesMemo, self).clear()
+
+
+shared_memo = SharedValuesMemo()
+
+
+def request_memo(request):
+    """Returns the memo of values for the request."""
+    try:
+        return request.ssi_values
+    except AttributeError:
+        request.ssi_values = ValuesMemo()
+        return request.ssi_values
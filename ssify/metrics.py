@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Instrumentation of the ssify request pipeline.
+
+If SSIFY_METRICS_COLLECTOR is set to a dotted path of a collector class,
+ssify reports what it's doing to an instance of it:
+
+ * `provide_vars_seconds`: time of providing SSI variables for a page,
+ * `page_variables`: number of SSI variables provided for a page,
+ * `variable_seconds`: time of computing a group of variables,
+   by `variable`,
+ * `variables_computed_total`: number of computed variables,
+   by `variable`,
+ * `manifest_decode_seconds`: time of decoding the variables
+   of a cached response,
+ * `prepare_for_cache_seconds`: time spent in PrepareForCacheMiddleware,
+ * `includes_total`: number of SSI includes output, by `view`,
+ * `cache_write_seconds`: time of writing includes to a cache,
+   by `cache`.
+
+Collectors implement `increment` and `observe`, see `Collector`.
+`MemoryCollector` keeps the metrics in the process, and exports them
+in Prometheus text format (see `prometheus_view`; note that every
+process has its own metrics). `StatsdCollector` sends them to a statsd
+server. Without a collector, the overhead is a single check.
+
+"""
+from __future__ import unicode_literals
+import socket
+from threading import Lock
+import time
+from django.http import HttpResponse
+from .conf import conf
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    # Django < 1.8
+    from django.test.signals import setting_changed
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:
+    # Django < 1.7
+    from django.utils.module_loading import import_by_path as import_string
+
+
+PREFIX = 'ssify'
+
+
+class Collector(object):
+    """Base class for collectors. Discards everything."""
+    def increment(self, name, value=1, labels=None):
+        """Adds value to a counter."""
+
+    def observe(self, name, value, labels=None):
+        """Records a single observation, like a duration in seconds."""
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class MemoryCollector(Collector):
+    """Keeps counters and sums of observations in the process."""
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = {}
+        self.summaries = {}
+
+    def increment(self, name, value=1, labels=None):
+        key = (name, _labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = (name, _labels_key(labels))
+        with self.lock:
+            count, total = self.summaries.get(key, (0, 0))
+            self.summaries[key] = (count + 1, total + value)
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.summaries.clear()
+
+    def prometheus(self):
+        """Returns the metrics in Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            summaries = sorted(self.summaries.items())
+        lines = []
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append('# TYPE %s_%s counter' % (PREFIX, name))
+                last_name = name
+            lines.append('%s_%s%s %s' % (
+                PREFIX, name, _prometheus_labels(labels), value))
+        for (name, labels), (count, total) in summaries:
+            if name != last_name:
+                lines.append('# TYPE %s_%s summary' % (PREFIX, name))
+                last_name = name
+            labels = _prometheus_labels(labels)
+            lines.append('%s_%s_count%s %d' % (PREFIX, name, labels, count))
+            lines.append('%s_%s_sum%s %r' % (
+                PREFIX, name, labels, float(total)))
+        return ''.join(line + '\n' for line in lines)
+
+
+def _prometheus_label_value(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, _prometheus_label_value(v)) for k, v in labels)
+
+
+def statsd_line(name, value, kind, labels=None):
+    """
+    Formats a statsd metric. Label values are appended to the name.
+
+    Observations of durations (named `*_seconds`) are sent as timings
+    in milliseconds, other ones as histograms.
+
+    """
+    parts = [PREFIX, name] + ['%s' % v for k, v in _labels_key(labels)]
+    name = '.'.join(part.replace('.', '_').replace(':', '_')
+                    for part in parts)
+    if kind == 'c':
+        return '%s:%s|c' % (name, value)
+    if name.endswith('_seconds'):
+        return '%s:%.3f|ms' % (name[:-len('_seconds')], value * 1000)
+    return '%s:%s|h' % (name, value)
+
+
+class StatsdCollector(Collector):
+    """
+    Sends the metrics to statsd over UDP.
+
+    The address is taken from SSIFY_METRICS_STATSD_HOST
+    and SSIFY_METRICS_STATSD_PORT.
+
+    """
+    def __init__(self, host=None, port=None):
+        self.address = (host or conf.METRICS_STATSD_HOST,
+                        port or conf.METRICS_STATSD_PORT)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, line):
+        try:
+            self.socket.sendto(line.encode('utf-8'), self.address)
+        except socket.error:
+            pass
+
+    def increment(self, name, value=1, labels=None):
+        self.send(statsd_line(name, value, 'c', labels))
+
+    def observe(self, name, value, labels=None):
+        self.send(statsd_line(name, value, 'o', labels))
+
+
+_collector = []
+
+
+def get_collector():
+    """Returns the configured collector, or None."""
+    if not _collector:
+        path = conf.METRICS_COLLECTOR
+        _collector.append(import_string(path)() if path else None)
+    return _collector[0]
+
+
+def _reset_collector(setting, **kwargs):
+    if setting.startswith('SSIFY_METRICS_'):
+        del _collector[:]
+setting_changed.connect(_reset_collector)
+
+
+def increment(name, value=1, labels=None):
+    collector = get_collector()
+    if collector is not None:
+        collector.increment(name, value, labels)
+
+
+def observe(name, value, labels=None):
+    collector = get_collector()
+    if collector is not None:
+        collector.observe(name, value, labels)
+
+
+class timed(object):
+    """Context manager observing the time spent inside, in seconds."""
+    __slots__ = ('name', 'labels', 'collector', 'start')
+
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.collector = get_collector()
+        if self.collector is not None:
+            self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.collector is not None:
+            self.collector.observe(
+                self.name, time.time() - self.start, self.labels)
+
+
+def prometheus_view(request):
+    """Exposes the metrics of a MemoryCollector for Prometheus."""
+    collector = get_collector()
+    content = collector.prometheus() if hasattr(
+        collector, 'prometheus') else ''
+    return HttpResponse(content, content_type='text/plain; version=0.0.4')
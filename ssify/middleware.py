@@ -37,16 +37,33 @@ So, you should end up with something like this:
 """
 from __future__ import unicode_literals
 from django.conf import settings
+import logging
 from django.middleware import locale
-from django.utils.cache import patch_vary_headers
+from django.utils.cache import add_never_cache_headers, patch_vary_headers
 from .conf import conf
+from . import metrics
+from .exceptions import SsiVarsManifestMissingError
+from .manifest import (add_manifest, get_plan,
+                       has_manifest)
 from .serializers import json_decode, json_encode
 from .utils import ssi_vary_on_cookie
-from .variables import SsiVariable, provide_vars
+from .variables import provide_vars
+
+
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError:
+    try:
+        from asyncio import iscoroutinefunction
+    except ImportError:
+        # Python 2
+        iscoroutinefunction = lambda func: False
 
 
 CACHE_HEADERS = ('Pragma', 'Cache-Control', 'Vary')
 
+logger = logging.getLogger('ssify')
+
 
 class PrepareForCacheMiddleware(object):
     """
@@ -56,41 +73,41 @@ class PrepareForCacheMiddleware(object):
     """
     @staticmethod
     def process_response(request, response):
-        """Adds a 'X-Ssi-Vars-Needed' header to the response."""
-        if ('X-Ssi-Vars-Needed' not in response and
-                getattr(request, 'ssi_vars_needed', None)):
-            vars_needed = {}
-            for (k, v) in request.ssi_vars_needed.items():
-                vars_needed[k] = v.definition
-            response['X-Ssi-Vars-Needed'] = json_encode(
-                vars_needed, sort_keys=True)
-
-        if ('X-ssi-restore' not in response and
-                getattr(request, 'ssi_patch_response', None)):
-            # We have some response modifiers set by ssi_includes and
-            # ssi_variables. Those are used, because unrendered SSI
-            # templates Django cache receives should have different
-            # caching headers, than pages rendered with request-specific
-            # information.
-            # What we do here is apply the modifiers, but restore
-            # previous values of any cache-relevant headers and set
-            # a custom header with modified values to set them
-            # after-cache.
-            original_fields = {}
-            for field in CACHE_HEADERS:
-                original_fields[field] = response.get(field, None)
-            for modifier in request.ssi_patch_response:
-                modifier(response)
-            restore_fields = {}
-            for field in CACHE_HEADERS:
-                new_value = response.get(field, None)
-                if new_value != original_fields[field]:
-                    restore_fields[field] = new_value
-                    if original_fields[field] is None:
-                        del response[field]
-                    else:
-                        response[field] = original_fields[field]
-            response['X-ssi-restore'] = json_encode(restore_fields)
+        """
+        Adds a 'X-Ssi-Vars-Needed' or 'X-Ssi-Vars-Manifest' header
+        to the response.
+        """
+        with metrics.timed('prepare_for_cache_seconds'):
+            if (not has_manifest(response) and
+                    getattr(request, 'ssi_vars_needed', None)):
+                add_manifest(response, request.ssi_vars_needed)
+
+            if ('X-ssi-restore' not in response and
+                    getattr(request, 'ssi_patch_response', None)):
+                # We have some response modifiers set by ssi_includes and
+                # ssi_variables. Those are used, because unrendered SSI
+                # templates Django cache receives should have different
+                # caching headers, than pages rendered with request-specific
+                # information.
+                # What we do here is apply the modifiers, but restore
+                # previous values of any cache-relevant headers and set
+                # a custom header with modified values to set them
+                # after-cache.
+                original_fields = {}
+                for field in CACHE_HEADERS:
+                    original_fields[field] = response.get(field, None)
+                for modifier in request.ssi_patch_response:
+                    modifier(response)
+                restore_fields = {}
+                for field in CACHE_HEADERS:
+                    new_value = response.get(field, None)
+                    if new_value != original_fields[field]:
+                        restore_fields[field] = new_value
+                        if original_fields[field] is None:
+                            del response[field]
+                        else:
+                            response[field] = original_fields[field]
+                response['X-ssi-restore'] = json_encode(restore_fields)
 
         return response
 
@@ -110,26 +127,87 @@ class SsiMiddleware(object):
     statements, so you can see the output without an actual
     SSI-enabled webserver.
 
+    It works both in MIDDLEWARE_CLASSES and in MIDDLEWARE. Under ASGI,
+    it runs asynchronously, and values of independent SSI variables
+    are computed concurrently (see `ssify.asynchronous`).
+
+    Streaming responses are supported: the content isn't buffered,
+    but SSI set statements for any variables used in a chunk are
+    inserted just before it. Note that headers of a streaming response
+    are sent before its content is generated, so only response modifiers
+    registered before that can be applied.
+
     """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self.is_async = (get_response is not None and
+                         iscoroutinefunction(get_response))
+        if self.is_async:
+            from .asynchronous import markcoroutinefunction
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            from .asynchronous import middleware_acall
+            return middleware_acall(self, request)
+        self.process_request(request)
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
     def process_request(self, request):
         request.ssi_patch_response = []
 
     def process_view(self, request, view_func, view_args, view_kwargs):
         request.ssi_vars_needed = {}
 
-    def _process_rendered_response(self, request, response):
-        # Prepend the SSI variables.
-        if hasattr(request, 'ssi_vars_needed'):
-            vars_needed = request.ssi_vars_needed
-        else:
-            vars_needed = json_decode(response.get('X-Ssi-Vars-Needed', '{}'))
-            for k, v in vars_needed.items():
-                vars_needed[k] = SsiVariable(*v)
+    @staticmethod
+    def _stream_with_vars(request, content):
+        """Inserts SSI set statements for variables used in each chunk."""
+        values = {}
+        for chunk in content:
+            # Generating the chunk might have required new variables.
+            vars_needed = getattr(request, 'ssi_vars_needed', {})
+            if len(vars_needed) > len(values):
+                new_vars = dict((k, v) for (k, v) in vars_needed.items()
+                                if k not in values)
+                yield provide_vars(request, new_vars, values=values)
+            yield chunk
 
-        if vars_needed:
-            response.content = provide_vars(request, vars_needed) + \
-                response.content
+    @staticmethod
+    def _prepend_content(response, content):
+        """Prepends content to the response without copying the body."""
+        # HttpResponse keeps its content as a list of bytestrings
+        # and only joins them when asked for `content`.
+        response._container = [content] + list(response._container)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = \
+                int(response['Content-Length']) + len(content)
 
+    @staticmethod
+    def _vars_needed(request, response):
+        """
+        Returns the variables needed and their levels, if known.
+
+        If the manifest of a cached response has been evicted, returns
+        None for both. The page is then served without the variables,
+        see `_patch_headers`.
+
+        """
+        if hasattr(request, 'ssi_vars_needed'):
+            return request.ssi_vars_needed, None
+        # Response from cache.
+        try:
+            with metrics.timed('manifest_decode_seconds'):
+                return get_plan(request, response)
+        except SsiVarsManifestMissingError as e:
+            logger.warning('%s', e)
+            return None, None
+
+    @staticmethod
+    def _patch_headers(request, response, vars_needed=()):
         if 'X-ssi-restore' in response:
             # The modifiers have already been applied to the response
             # by the PrepareForCacheMiddleware.
@@ -142,9 +220,28 @@ class SsiMiddleware(object):
         else:
             for response_modifier in getattr(request, 'ssi_patch_response', []):
                 response_modifier(response)
+        if vars_needed is None:
+            # The variables are missing, so the page must not be cached
+            # by the clients.
+            add_never_cache_headers(response)
+
+
+    def _process_rendered_response(self, request, response):
+        # Prepend the SSI variables.
+        vars_needed = ()
+        if response.streaming:
+            response.streaming_content = self._stream_with_vars(
+                request, response.streaming_content)
+        else:
+            vars_needed, levels = self._vars_needed(request, response)
+            if vars_needed:
+                self._prepend_content(
+                    response, provide_vars(request, vars_needed, levels))
+        self._patch_headers(request, response, vars_needed)
 
     def process_response(self, request, response):
-        if hasattr(response, 'render') and callable(response.render):
+        if (hasattr(response, 'render') and callable(response.render) and
+                not response.is_rendered):
             response.add_post_render_callback(
                 lambda r: self._process_rendered_response(request, r)
             )
@@ -11,139 +11,321 @@ support as a proxy (i.e. Nginx with ssi=on).
 
 """
 from __future__ import unicode_literals
+from collections import namedtuple
+from copy import copy
+from multiprocessing.pool import ThreadPool
 import re
+from threading import Lock
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
 from django.core.urlresolvers import resolve
-from .cache import get_caches
+from django.utils import translation
+from .cache import get_many_includes
 
 from .conf import conf
 
+try:
+    from django.db import close_old_connections
+except ImportError:
+    # Django < 1.6
+    from django.db import close_connection as close_old_connections
 
-SSI_SET = re.compile(r"<!--#set var='(?P<var>[^']+)' "
-                     r"value='(?P<value>|\\\\|.*?[^\\](?:\\\\)*)'-->", re.S)
-SSI_ECHO = re.compile(r"<!--#echo var='(?P<var>[^']+)' encoding='none'-->")
-SSI_INCLUDE = re.compile(r"<!--#include (?:virtual|file)='(?P<path>[^']+)'-->")
-SSI_IF = re.compile(r"(?P<header><!--#if expr='(?P<expr>[^']*)'-->)"
-                    r"(?P<value>.*?)(?:<!--#else-->(?P<else>.*?))?"
-                    r"<!--#endif-->", re.S)
-        # TODO: escaped?
-SSI_VAR = re.compile(r"\$\{(?P<var>.+)\}")  # TODO: escaped?
 
+SSI_DIRECTIVE = re.compile(br"<!--#(?P<command>[a-z]+)"
+                           br"(?P<params>(?:\s+[a-z]+='(?:[^'\\]|\\.)*')*)"
+                           br"\s*-->", re.S)
+SSI_PARAM = re.compile(br"(?P<name>[a-z]+)='(?P<value>(?:[^'\\]|\\.)*)'",
+                       re.S)
+SSI_ESCAPE = re.compile(br"\\(.)", re.S)
+SSI_VAR = re.compile(br"\$\{(?P<var>[^}]+)\}")
+SSI_START = b'<!--#'
 
-class SsiRenderMiddleware(object):
+# Placeholder for an include statement, until the content is fetched.
+Include = namedtuple('Include', 'path statement')
+
+_pool = []
+_pool_lock = Lock()
+
+
+def _get_pool():
+    with _pool_lock:
+        if not _pool:
+            _pool.append(ThreadPool(conf.RENDER_THREADS))
+        return _pool[0]
+
+
+# Marks the end of an input chunk.
+CHUNK_END = object()
+
+
+def _unescape(value):
+    """Unescapes quotes in a parameter value, like Nginx does."""
+    return SSI_ESCAPE.sub(
+        lambda m: m.group(1) if m.group(1) == b"'" else m.group(0), value)
+
+
+def _incomplete_start(data, pos):
+    """Finds where an unfinished SSI statement may start in the data."""
+    start = data.rfind(SSI_START, pos)
+    if start != -1 and data.find(b'-->', start) == -1:
+        return start
+    for i in range(max(pos, len(data) - len(SSI_START) + 1), len(data)):
+        if SSI_START.startswith(data[i:]):
+            return i
+    return len(data)
+
+
+def _end_marker(statement):
+    return statement.replace(SSI_START, b'<!--#end-', 1)
+
+
+def _clone_request(request, path):
     """
-    Emulates a webserver with SSI support.
+    Makes a copy of the request for rendering an included view.
 
-    This middleware should only be used for debugging purposes.
-    SsiMiddleware will enable it automatically, if SSIFY_RENDER setting
-    is set to True, so you don't normally need to include it in
-    MIDDLEWARE_CLASSES.
+    The copy is shallow. The memo of SSI variable values is shared
+    on purpose, so that included views don't compute the same values
+    again. Lazy attributes like `request.user` and `request.session`
+    are shared too, and are not safe to evaluate concurrently: with
+    SSIFY_RENDER_THREADS above 1, they should be evaluated before
+    (e.g. by a middleware), or included views shouldn't use them.
+
+    """
+    parsed = urlparse(path)
+    request = copy(request)
+    request.META = dict(request.META)
+    request.META['PATH_INFO'] = request.path_info = \
+        request.path = parsed.path
+    request.META['QUERY_STRING'] = parsed.query
+    request.resolver_match = None
+    request.ssi_vars_needed = {}
+    request.ssi_patch_response = []
+    return request
 
-    If SSIFY_RENDER_VERBOSE setting is True, it will also leave some
-    information in HTML comments.
 
+class SsiRenderer(object):
     """
+    Single-pass interpreter of SSI statements.
+
+    Works on bytes, takes the content as an iterable of chunks,
+    and yields the output as soon as it's ready.
+
+    Includes in every input chunk are collected first, then looked up
+    in bulk in the caches, and views for any missing ones are rendered
+    concurrently on a pool of SSIFY_RENDER_THREADS threads, each with
+    its own shallow copy of the request (see `_clone_request`). Note
+    that the included contents are interpreted with variable values
+    from the end of the chunk.
+
+    """
+    def __init__(self, request):
+        self.request = request
+        self.variables = {}
+        self.verbose = conf.RENDER_VERBOSE
+
     @staticmethod
-    def _process_rendered_response(request, response):
-        """Recursively process SSI statements in the response."""
-        def ssi_include(match):
-            """Replaces SSI include with contents rendered by relevant view."""
-            path = process_value(match.group('path'))
-            content = None
-            for cache in get_caches():
-                content = cache.get(path)
-                if content is not None:
-                    break
-            if content is None:
-                func, args, kwargs = resolve(path)
-                parsed = urlparse(path)
-
-                # Reuse the original request, but reset some attributes.
-                request.META['PATH_INFO'] = request.path_info = \
-                    request.path = parsed.path
-                request.META['QUERY_STRING'] = parsed.query
-                request.ssi_vars_needed = {}
-
-                subresponse = func(request, *args, **kwargs)
-                # FIXME: we should deal directly with bytes here.
-                if subresponse.streaming:
-                    content = b"".join(subresponse.streaming_content)
-                else:
-                    content = subresponse.content
-            content = process_content(content.decode('utf-8'))
-            if conf.RENDER_VERBOSE:
-                return "".join((
-                    match.group(0),
-                    content,
-                    match.group(0).replace('<!--#', '<!--#end-'),
-                ))
-            else:
-                return content
+    def tokenize(chunks):
+        """
+        Splits the content into text and SSI statements.
 
-        def ssi_set(match):
-            """Interprets SSI set statement."""
-            variables[match.group('var')] = match.group('value')
-            if conf.RENDER_VERBOSE:
-                return match.group(0)
-            else:
-                return ""
-
-        def ssi_echo(match):
-            """Interprets SSI echo, outputting the value of the variable."""
-            content = variables[match.group('var')]
-            if conf.RENDER_VERBOSE:
-                return "".join((
-                    match.group(0),
-                    content,
-                    match.group(0).replace('<!--#', '<!--#end-'),
-                ))
+        Yields (text, match) pairs, where match is None for plain text,
+        and CHUNK_END after every input chunk. Statements split between
+        chunks are held until complete.
+
+        """
+        data = b''
+        for chunk in chunks:
+            data += chunk
+            pos = 0
+            for match in SSI_DIRECTIVE.finditer(data):
+                if match.start() > pos:
+                    yield data[pos:match.start()], None
+                yield match.group(0), match
+                pos = match.end()
+            hold = _incomplete_start(data, pos)
+            if hold > pos:
+                yield data[pos:hold], None
+            data = data[hold:]
+            yield CHUNK_END
+        if data:
+            yield data, None
+
+    def process_value(self, value):
+        """Resolves any ${var}-style variable references in the value."""
+        return SSI_VAR.sub(lambda m: self.variables[m.group('var')], value)
+
+    def render_view(self, path):
+        """Renders the view for an included path."""
+        func, args, kwargs = resolve(path)
+        subresponse = func(_clone_request(self.request, path),
+                           *args, **kwargs)
+        if (hasattr(subresponse, 'render') and
+                callable(subresponse.render) and
+                not subresponse.is_rendered):
+            subresponse.render()
+        if subresponse.streaming:
+            return b"".join(subresponse.streaming_content)
+        else:
+            return subresponse.content
+
+    def _render_view_in_thread(self, args):
+        """
+        Renders an included view in a pool thread.
+
+        Database connections of the thread are treated like those of
+        a request: they're kept for CONN_MAX_AGE seconds, and closed
+        when they become obsolete or unusable.
+
+        """
+        path, language = args
+        close_old_connections()
+        translation.activate(language)
+        try:
+            return self.render_view(path)
+        finally:
+            translation.deactivate()
+            close_old_connections()
+
+    def fetch(self, paths):
+        """Returns a dict of contents for included paths."""
+        contents = get_many_includes(paths)
+        missing = [path for path in paths if path not in contents]
+        if len(missing) > 1 and conf.RENDER_THREADS > 1:
+            language = translation.get_language()
+            rendered = _get_pool().map(
+                self._render_view_in_thread,
+                [(path, language) for path in missing])
+        else:
+            rendered = [self.render_view(path) for path in missing]
+        contents.update(zip(missing, rendered))
+        return contents
+
+    def interpret(self, chunks):
+        """
+        Interprets SSI statements in the content.
+
+        Yields output bytes, Include placeholders and CHUNK_END markers.
+
+        """
+        # For every open if statement: whether the enclosing block
+        # is active, whether some branch was taken, and the statement.
+        ifs = []
+        active = True
+        for token in self.tokenize(chunks):
+            if token is CHUNK_END:
+                yield token
+                continue
+            text, match = token
+            if match is None:
+                if active:
+                    yield text
+                continue
+
+            command = match.group('command')
+            params = dict(
+                (name, _unescape(value)) for (name, value)
+                in SSI_PARAM.findall(match.group('params')))
+
+            if command == b'if':
+                taken = active and bool(self.process_value(params[b'expr']))
+                ifs.append([active, taken, text])
+                if active and self.verbose:
+                    yield text
+                active = taken
+            elif command == b'elif':
+                block = ifs[-1]
+                active = (block[0] and not block[1] and
+                          bool(self.process_value(params[b'expr'])))
+                block[1] = block[1] or active
+            elif command == b'else':
+                block = ifs[-1]
+                active = block[0] and not block[1]
+                block[1] = True
+            elif command == b'endif':
+                block = ifs.pop()
+                active = block[0]
+                if active and self.verbose:
+                    yield _end_marker(block[2])
+            elif not active:
+                continue
+            elif command == b'set':
+                self.variables[params[b'var']] = params[b'value']
+                if self.verbose:
+                    yield text
+            elif command == b'echo':
+                if self.verbose:
+                    yield text
+                yield self.variables[params[b'var']]
+                if self.verbose:
+                    yield _end_marker(text)
+            elif command == b'include':
+                path = self.process_value(
+                    params.get(b'virtual') or params[b'file'])
+                yield Include(path.decode('utf-8'), text)
             else:
-                return content
+                yield text
 
-        def ssi_if(match):
-            """Interprets SSI if statement."""
-            expr = process_value(match.group('expr'))
-            if expr:
-                content = match.group('value')
+    def _flush(self, pieces):
+        """Fetches includes in bulk and yields the complete output."""
+        contents = self.fetch(set(
+            piece.path for piece in pieces if isinstance(piece, Include)))
+        for piece in pieces:
+            if isinstance(piece, Include):
+                if self.verbose:
+                    yield piece.statement
+                for chunk in self.render([contents[piece.path]]):
+                    yield chunk
+                if self.verbose:
+                    yield _end_marker(piece.statement)
             else:
-                content = match.group('else') or ''
-            if conf.RENDER_VERBOSE:
-                return "".join((
-                    match.group('header'),
-                    content,
-                    match.group('header').replace('<!--#', '<!--#end-'),
-                ))
+                yield piece
+
+    def render(self, chunks):
+        """Renders the content, with all the includes."""
+        pieces = []
+        for piece in self.interpret(chunks):
+            if piece is CHUNK_END:
+                for chunk in self._flush(pieces):
+                    yield chunk
+                pieces = []
             else:
-                return content
+                pieces.append(piece)
+        for chunk in self._flush(pieces):
+            yield chunk
+
 
-        def ssi_var(match):
-            """Resolves ${var}-style variable reference."""
-            return variables[match.group('var')]
+class SsiRenderMiddleware(object):
+    """
+    Emulates a webserver with SSI support.
+
+    This middleware should only be used for debugging purposes.
+    SsiMiddleware will enable it automatically, if SSIFY_RENDER setting
+    is set to True, so you don't normally need to include it in
+    MIDDLEWARE_CLASSES.
 
-        def process_value(content):
-            """Resolves any ${var}-style variable references in the content."""
-            return re.sub(SSI_VAR, ssi_var, content)
+    If SSIFY_RENDER_VERBOSE setting is True, it will also leave some
+    information in HTML comments.
 
-        def process_content(content):
-            """Interprets SSI statements in the content."""
-            content = re.sub(SSI_SET, ssi_set, content)
-            content = re.sub(SSI_ECHO, ssi_echo, content)
-            content = re.sub(SSI_IF, ssi_if, content)
-            content = re.sub(SSI_INCLUDE, ssi_include, content)
-            return content
+    Streaming responses are rendered incrementally.
 
-        variables = {}
-        response.content = process_content(
-            response.content.decode('utf-8')).encode('utf-8')
-        response['Content-Length'] = len(response.content)
+    """
+    @staticmethod
+    def _process_rendered_response(request, response):
+        """Process SSI statements in the response."""
+        renderer = SsiRenderer(request)
+        if response.streaming:
+            response.streaming_content = renderer.render(
+                response.streaming_content)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
+        else:
+            response.content = b"".join(renderer.render([response.content]))
+            response['Content-Length'] = len(response.content)
 
     def process_response(self, request, response):
         """Support for unrendered responses."""
-        if response.streaming:
-            return response
         if hasattr(response, 'render') and callable(response.render):
             response.add_post_render_callback(
                 lambda r: self._process_rendered_response(request, r)
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+# Connect the signal handlers for model-driven invalidation.
+from . import dependencies
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Generates nginx configuration, used by the `ssify_nginx_conf` command.
+
+Every URL pattern of an `ssi_included` view gets a location serving
+the included contents straight from the first cache nginx can read:
+a `StaticFileBasedCache`, or a memcached server (with `memcached_pass`),
+unless its contents are compressed (see SSIFY_CACHE_COMPRESS).
+Anything missing in the cache, and all the other requests, are passed
+to Django.
+
+"""
+from __future__ import unicode_literals
+from django.conf import settings
+from .cache import get_caches, is_compressed_cache
+from .cache_backends import StaticFileBasedCache
+from .conf import conf
+from .warm import included_patterns
+
+
+FALLBACK = '@django'
+
+
+def _indent(text, level=1):
+    return ''.join(('    ' * level + line if line else line)
+                   for line in text.splitlines(True))
+
+
+def memcached_location(cache, fallback):
+    """
+    Returns the location directives for serving from memcached,
+    or None if it's not possible.
+
+    """
+    servers = getattr(cache, '_servers', None)
+    key = cache.make_key('$uri')
+    if not servers or len(servers) > 1 or '$uri' not in key:
+        # Nginx can't know which server or key to use.
+        return None
+    return (
+        'set $memcached_key "%s";\n'
+        'memcached_pass %s;\n'
+        'default_type text/html;\n'
+        'error_page 404 502 504 = %s;\n' % (key, servers[0], fallback))
+
+
+def cache_config(fallback=FALLBACK):
+    """
+    Returns directives for the http and location contexts
+    for serving includes from the first suitable cache.
+
+    Returns None if no cache can be read by nginx.
+
+    """
+    for i, cache in enumerate(get_caches()):
+        if isinstance(cache, StaticFileBasedCache):
+            http, location = cache.nginx_config(fallback)
+            return http, 'default_type text/html;\n' + location
+        if ('memcache' in type(cache).__name__.lower() and
+                not is_compressed_cache(i)):
+            location = memcached_location(cache, fallback)
+            if location is not None:
+                return '', location
+    return None
+
+
+def location_regex(regex):
+    """Makes an nginx location regex out of the pattern regex."""
+    return '"^/%s"' % regex.replace('"', r'\"')
+
+
+def nginx_config(upstream, listen='80', server_name=None):
+    """Returns the nginx configuration for the project."""
+    if server_name is None:
+        server_name = ' '.join(
+            host for host in settings.ALLOWED_HOSTS
+            if host != '*') or '_'
+    served = cache_config()
+
+    config = (
+        '# Generated by ssify_nginx_conf.\n'
+        'upstream ssify_django {\n'
+        '    server %s;\n'
+        '}\n\n' % upstream)
+    if served is not None and served[0]:
+        config += served[0] + '\n'
+    config += (
+        'server {\n'
+        '    listen %s;\n'
+        '    server_name %s;\n'
+        '\n'
+        '    ssi on;\n'
+        '    ssi_value_length %d;\n'
+        '\n' % (listen, server_name, conf.SSI_VALUE_LENGTH))
+
+    if served is None:
+        config += ('    # None of the caches can be read by nginx,\n'
+                   '    # so the includes are always passed to Django.\n\n')
+    else:
+        regexes = []
+        for view, pattern, regex in included_patterns():
+            if regex not in regexes:
+                regexes.append(regex)
+        for regex in regexes:
+            config += '    location ~ %s {\n%s    }\n\n' % (
+                location_regex(regex), _indent(served[1], 2))
+
+    proxy = (
+        'proxy_pass http://ssify_django;\n'
+        'proxy_set_header Host $host;\n'
+        'proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;\n'
+        'proxy_set_header X-Forwarded-Proto $scheme;\n')
+    config += (
+        '    location / {\n%s    }\n\n'
+        '    location %s {\n%s    }\n'
+        '}\n' % (_indent(proxy, 2), FALLBACK, _indent(proxy, 2)))
+    return config
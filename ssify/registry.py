@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Registry of cached includes, for targeted invalidation.
+
+If SSIFY_REGISTRY_CACHE is set to a cache alias, `cache_include` records
+every cached path there, along with its tags, so that includes can be
+flushed by URL prefix or by tag, and flushing everything doesn't need
+to clear whole caches, possibly shared with other data.
+
+Paths are kept in sets: one for every tag, and one for every bucket
+of paths with the same first segment. A set is stored as a log of small
+slots, so that it can grow beyond the size limit of a cache item, and
+adding to it doesn't need to rewrite it. Adding an item takes an atomic
+`add` of a marker key, so every item is written only once, and an
+atomic `incr` of the slot counter, so concurrent writers never
+overwrite each other's slots. Sets are cleared by bumping their
+generation, which is a part of all their keys; the old keys are left
+to expire.
+
+SSIFY_REGISTRY_CACHE should support atomic `add` and `incr`, like
+memcached does.
+
+"""
+from __future__ import unicode_literals
+from hashlib import md5
+from .conf import conf
+
+
+BUCKETS = 'buckets'
+BUCKET = 'bucket:%s'
+TAG = 'tag:%s'
+
+GENERATION_KEY = 'ssify:registry:%s'
+COUNT_KEY = 'ssify:registry:%s:%d'
+SLOT_KEY = 'ssify:registry:%s:%d:%d'
+MARKER_KEY = 'ssify:registry:%s:%d:has:%s'
+MODEL_KEY = 'ssify:registry:model:%s'
+
+# Items in a single slot.
+SLOT_SIZE = 1000
+
+
+def enabled():
+    return bool(conf.REGISTRY_CACHE)
+
+
+def _cache():
+    return get_cache(conf.REGISTRY_CACHE)
+
+
+def _hashed(value):
+    return md5(value.encode('utf-8')).hexdigest()
+
+
+def _bucket(path):
+    """Paths are grouped by their first segment."""
+    return path.lstrip('/').split('/', 1)[0]
+
+
+def _generation(cache, name):
+    return cache.get(GENERATION_KEY % name) or 0
+
+
+def _incr(cache, key, delta=1):
+    """Increments a counter, creating it if needed."""
+    timeout = conf.REGISTRY_TIMEOUT
+    while True:
+        cache.add(key, 0, timeout=timeout)
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            # Evicted just now.
+            pass
+
+
+def _add(cache, name, items):
+    """Adds items to a set stored in the cache."""
+    timeout = conf.REGISTRY_TIMEOUT
+    generation = _generation(cache, name)
+    new = [item for item in sorted(items)
+           if cache.add(MARKER_KEY % (name, generation, _hashed(item)),
+                        True, timeout=timeout)]
+    if not new:
+        return
+    slots = [new[i:i + SLOT_SIZE] for i in range(0, len(new), SLOT_SIZE)]
+    last = _incr(cache, COUNT_KEY % (name, generation), len(slots))
+    cache.set_many(dict(
+        (SLOT_KEY % (name, generation, last - len(slots) + i + 1), slot)
+        for i, slot in enumerate(slots)), timeout=timeout)
+
+
+def _members(cache, name):
+    """Returns the items of a set stored in the cache."""
+    generation = _generation(cache, name)
+    count = cache.get(COUNT_KEY % (name, generation)) or 0
+    stored = cache.get_many([SLOT_KEY % (name, generation, i)
+                             for i in range(1, count + 1)])
+    return set(item for slot in stored.values() for item in slot)
+
+
+def _forget(cache, name):
+    """Empties a set stored in the cache."""
+    _incr(cache, GENERATION_KEY % name)
+
+
+def register(paths, tags=()):
+    """Records the paths as cached, with given tags."""
+    if not enabled():
+        return
+    cache = _cache()
+    paths = set(paths)
+    buckets = {}
+    for path in paths:
+        buckets.setdefault(_bucket(path), set()).add(path)
+    _add(cache, BUCKETS, buckets)
+    for bucket, bucket_paths in buckets.items():
+        _add(cache, BUCKET % _hashed(bucket), bucket_paths)
+    for tag in tags:
+        _add(cache, TAG % _hashed(tag), paths)
+
+
+def with_prefix(prefix):
+    """Returns all the registered paths starting with the prefix."""
+    cache = _cache()
+    first = _bucket(prefix)
+    if '/' in prefix.lstrip('/'):
+        # Prefix contains the whole first segment.
+        buckets = [first]
+    else:
+        buckets = [bucket for bucket in _members(cache, BUCKETS)
+                   if bucket.startswith(first)]
+    return set(path for bucket in buckets
+               for path in _members(cache, BUCKET % _hashed(bucket))
+               if path.startswith(prefix))
+
+
+def all_paths():
+    """Returns all the registered paths."""
+    return with_prefix('/')
+
+
+def tagged(tags):
+    """Returns all the paths registered with any of the tags."""
+    cache = _cache()
+    return set(path for tag in tags
+               for path in _members(cache, TAG % _hashed(tag)))
+
+
+def forget_tags(tags):
+    cache = _cache()
+    for tag in tags:
+        _forget(cache, TAG % _hashed(tag))
+
+
+def clear():
+    """Forgets all the paths. Tags are left to expire."""
+    cache = _cache()
+    for bucket in _members(cache, BUCKETS):
+        _forget(cache, BUCKET % _hashed(bucket))
+    _forget(cache, BUCKETS)
+
+
+def mark_model(label):
+    """Marks the model as having dependants (see `ssify.dependencies`)."""
+    _cache().set(MODEL_KEY % label, True, timeout=conf.REGISTRY_TIMEOUT)
+
+
+def is_model_marked(label):
+    return bool(_cache().get(MODEL_KEY % label))
+
+
+from .cache import get_cache
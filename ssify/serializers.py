@@ -31,5 +31,44 @@ def json_encode(obj, **kwargs):
         **kwargs).encode(obj)
 
 
+def _canonical(definition):
+    """
+    Replaces the kwargs of a definition with a list sorted by key.
+
+    Keys and values alternate in the list. A flat list, unlike pairs,
+    doesn't add a level of nesting, so the encoder doesn't hit
+    the recursion limit any sooner on long chains of variables.
+
+    """
+    if len(definition) < 3:
+        return definition
+    kwargs = definition[2]
+    flat = []
+    for key in sorted(kwargs):
+        flat.append(key)
+        flat.append(kwargs[key])
+    return definition[0], definition[1], flat
+
+
+def _definition_default(o):
+    if isinstance(o, SsiVariable):
+        return {'__var__': _canonical(o.definition)}
+    return _json_default(o)
+
+
+_definition_encoder = json.JSONEncoder(
+    default=_definition_default, separators=(',', ':'))
+
+
+def json_encode_definition(definition):
+    """
+    Encodes a variable definition, with kwargs in a canonical order.
+
+    Definitions without kwargs are encoded just like by `json_encode`.
+
+    """
+    return _definition_encoder.encode(_canonical(definition))
+
+
 def json_decode(data, **kwargs):
     return json.loads(data, object_hook=_json_obj_hook, **kwargs)
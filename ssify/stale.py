@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Stale-while-revalidate for SSI included views.
+
+Views decorated with `ssi_included(stale_timeout=...)` keep a copy
+of their contents in the SSIFY_STALE_CACHE, for `stale_timeout` seconds
+longer than the include itself. When the include expires and requests
+for it reach Django, only the one getting a lock renders the view again.
+The others are served the stale copy until the new contents are cached.
+
+The lock is taken with the cache's atomic `add`, so SSIFY_STALE_CACHE
+should be shared by all the processes, and shouldn't be a file-based
+cache. It expires after SSIFY_STALE_LOCK_TIMEOUT seconds, in case
+the rendering process dies.
+
+Flushing includes deletes their stale copies too. When flushing
+everything without SSIFY_REGISTRY_CACHE, the paths aren't known,
+so the generation of all the stale copies is bumped instead.
+
+"""
+from __future__ import unicode_literals
+from hashlib import md5
+from .conf import conf
+
+
+STALE_KEY = 'ssify:stale:%d:%s'
+LOCK_KEY = 'ssify:lock:%s'
+GENERATION_KEY = 'ssify:stale'
+
+
+def _cache():
+    return get_cache(conf.STALE_CACHE)
+
+
+def _hashed(path):
+    return md5(path.encode('utf-8')).hexdigest()
+
+
+def _generation(cache):
+    return cache.get(GENERATION_KEY) or 0
+
+
+def acquire(path, version=None):
+    """Tries to take the lock for rendering the path. Returns success."""
+    return _cache().add(LOCK_KEY % _hashed(path), True,
+                        timeout=conf.STALE_LOCK_TIMEOUT, version=version)
+
+
+def release(path, version=None):
+    _cache().delete(LOCK_KEY % _hashed(path), version=version)
+
+
+def get(path, version=None):
+    """Returns the stale copy of the contents, or None."""
+    cache = _cache()
+    return cache.get(STALE_KEY % (_generation(cache), _hashed(path)),
+                     version=version)
+
+
+def store(path, content, timeout, stale_timeout, version=None):
+    """
+    Keeps a copy of fresh contents.
+
+    The timeout is the number of seconds the include itself is cached
+    for (None if it doesn't expire), and the copy is kept stale_timeout
+    seconds longer.
+
+    """
+    cache = _cache()
+    if timeout is not None:
+        timeout += stale_timeout
+    cache.set(STALE_KEY % (_generation(cache), _hashed(path)), content,
+              timeout=timeout, version=version)
+
+
+def forget(paths, version=None):
+    """Deletes the stale copies of the paths."""
+    cache = _cache()
+    generation = _generation(cache)
+    cache.delete_many([STALE_KEY % (generation, _hashed(path))
+                       for path in paths], version=version)
+
+
+def forget_all():
+    """Makes all the stale copies unreachable."""
+    cache = _cache()
+    while True:
+        cache.add(GENERATION_KEY, 0, timeout=None)
+        try:
+            cache.incr(GENERATION_KEY)
+            return
+        except ValueError:
+            # Evicted just now.
+            pass
+
+
+from .cache import get_cache
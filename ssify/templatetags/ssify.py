@@ -4,13 +4,11 @@
 #
 from __future__ import absolute_import, unicode_literals
 from django.conf import settings
-from django.core.urlresolvers import NoReverseMatch, reverse, resolve
 from django.middleware.csrf import get_token, _sanitize_token, rotate_token
 from django import template
-from django.utils.translation import get_language
 from ssify.decorators import ssi_variable
+from ssify.includes import ssi_include_statement, ssi_include_statements
 from ssify.utils import ssi_vary_on_cookie
-from ssify.variables import SsiVariable
 
 
 register = template.Library()
@@ -28,45 +26,22 @@ def ssi_include(context, name_, **kwargs):
     remembers any request-info the included piece declares as needed.
 
     """
-    b_kwargs = {'lang': get_language()}
-    subst = {}
-    num = 0
-    for k, value in kwargs.items():
-        if isinstance(value, SsiVariable):
-            numstr = '%04d' % num
-            b_kwargs[k] = numstr
-            subst[numstr] = value
-            num += 1
-        else:
-            b_kwargs[k] = value
+    return ssi_include_statement(context['request'], name_, kwargs)
 
-    try:
-        url = reverse(name_, kwargs=b_kwargs)
-    except NoReverseMatch:
-        b_kwargs.pop('lang')
-        url = reverse(name_, kwargs=b_kwargs)
-    view = resolve(url).func
-
-    for numstr, orig in subst.items():
-        url = url.replace(numstr, orig.as_var())
-    request = context['request']
-
-    # Remember the SSI vars the included view says it needs.
-    get_ssi_vars = getattr(view, 'get_ssi_vars', None)
-    if get_ssi_vars:
-        pass_vars = get_ssi_vars(**kwargs)
-        for var in pass_vars:
-            if not isinstance(var, SsiVariable):
-                var = SsiVariable(*var)
-            request.ssi_vars_needed[var.name] = var
-
-    # Remember the decorators to use on the including view.
-    patch_response = getattr(view, 'ssi_patch_response', None)
-    if patch_response:
-        request.ssi_patch_response.extend(patch_response)
-
-    # Output the SSI include.
-    return "<!--#include file='%s'-->" % url
+
+@register.simple_tag(takes_context=True)
+def ssi_include_each(context, name_, arg_name_, values_, **kwargs):
+    """
+    Inserts SSI include statements for an URL, for every value.
+
+    Every value is passed as the `arg_name_` keyword argument,
+    along with any other keyword arguments. This is the same as
+    using {% ssi_include %} in a loop, only faster.
+
+    """
+    return ''.join(ssi_include_statements(
+        context['request'], name_,
+        (dict(kwargs, **{arg_name_: value}) for value in values_)))
 
 
 @ssi_variable(register, patch_response=[ssi_vary_on_cookie])
@@ -11,11 +11,164 @@ at request time to the prerendered templates.
 """
 from __future__ import unicode_literals
 from hashlib import md5
+import logging
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+import time
+from zlib import adler32, crc32
 from django import template
+from django.utils import six, translation
 from django.utils.encoding import force_text, python_2_unicode_compatible
 from django.utils.functional import Promise
 from django.utils.safestring import mark_safe
-from .exceptions import SsiVarsDependencyCycleError
+from .exceptions import (SsiValueTooLongError, SsiVarsDependencyCycleError,
+                         SsiVarsDependencyMissingError)
+from .conf import conf
+from . import metrics
+from .memo import NOT_FOUND, request_memo, shared_memo
+
+try:
+    from django.db import close_old_connections
+except ImportError:
+    # Django < 1.6
+    from django.db import close_connection as close_old_connections
+
+
+logger = logging.getLogger('ssify')
+
+
+def _md5_digest(data):
+    return md5(data).hexdigest()
+
+
+def _crc_digest(data):
+    """64-bit, non-cryptographic digest."""
+    return '%08x%08x' % (crc32(data) & 0xffffffff, adler32(data) & 0xffffffff)
+
+
+DIGESTS = {
+    'md5': _md5_digest,
+    'crc': _crc_digest,
+}
+
+
+_names = {}
+
+
+class _Named(object):
+    """Stands for a nested variable in interning keys."""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '<%s>' % self.name
+
+
+def _shallow(value):
+    return _Named(value.name) if isinstance(value, SsiVariable) else value
+
+
+def _nested(definition):
+    """Yields variables nested directly in a definition."""
+    if len(definition) < 2:
+        return
+    for arg in definition[1]:
+        if isinstance(arg, SsiVariable):
+            yield arg
+    if len(definition) > 2:
+        for arg in definition[2].values():
+            if isinstance(arg, SsiVariable):
+                yield arg
+
+
+def _name_nested(definition):
+    """
+    Names all the variables nested in a definition, deepest first.
+
+    This way naming a long chain of variables doesn't recurse
+    through the whole chain.
+
+    """
+    unnamed = []
+    definitions = [definition]
+    while definitions:
+        for var in _nested(definitions.pop()):
+            if var._name is None:
+                unnamed.append(var)
+                definitions.append(var.definition)
+    for var in reversed(unnamed):
+        var.name
+
+
+def _shallow_repr(definition):
+    _name_nested(definition)
+    parts = (definition[0], tuple(_shallow(arg) for arg in definition[1]))
+    if len(definition) > 2:
+        parts += (dict((k, _shallow(v)) for k, v in definition[2].items()),)
+    return repr(parts)
+
+
+def _interning_key(definition):
+    """
+    Makes a key for interning the name of a variable definition.
+
+    Nested variables are represented by their names, which they keep
+    once computed, so the key doesn't recurse into their definitions.
+
+    """
+    if len(definition) == 1:
+        return repr(definition)
+    for var in _nested(definition):
+        return _shallow_repr(definition)
+    return repr(definition)
+
+
+def variable_name(definition):
+    """
+    Computes the variable name from its definition.
+
+    The name is a digest of the JSON-encoded definition (with kwargs
+    in a canonical order, see `json_encode_definition`). Names are
+    interned by the definition's repr (with nested variables represented
+    by their names), which is much cheaper to compute, so that naming
+    the same definition again doesn't need encoding and hashing. Only
+    definitions which can be JSON-encoded get into the cache, and for
+    those the repr is unambiguous.
+
+    """
+    key = _interning_key(definition)
+    try:
+        return _names[key]
+    except KeyError:
+        pass
+    digest = DIGESTS[conf.VARIABLE_NAME_DIGEST]
+    name = 'v' + digest(json_encode_definition(definition).encode('ascii'))
+    if len(_names) >= conf.VARIABLE_NAMES_MAX_ENTRIES:
+        _names.clear()
+    _names[key] = name
+    return name
+
+
+_tags = {}
+
+
+def get_tag(tagpath):
+    """
+    Finds the template tag defining an SSI variable.
+
+    Tags are looked up for every variable on every request,
+    so they're kept by tagpath.
+
+    """
+    try:
+        return _tags[tagpath]
+    except KeyError:
+        pass
+    taglib, tagname = tagpath.rsplit('.', 1)
+    tag = _tags[tagpath] = template.get_library(taglib).tags[tagname]
+    return tag
 
 
 @python_2_unicode_compatible
@@ -32,18 +185,25 @@ class SsiVariable(object):
     Variable's name, as used in SSI statements, is a hash of its definition,
     so the user never has to deal with it directly.
 
+    Variables are created in large numbers, so they use slots, keep
+    their args as a tuple, and shouldn't be modified after creation.
+    Variables with the same name are equal.
+
     """
+    __slots__ = ('tagpath', 'args', 'kwargs', '_name', '_hash')
+
     def __init__(self, tagpath=None, args=None, kwargs=None, name=None):
         self.tagpath = tagpath
-        self.args = list(args or [])
+        self.args = tuple(args) if args else ()
         self.kwargs = kwargs or {}
         self._name = name
+        self._hash = None
 
     @property
     def name(self):
         """Variable name is a hash of its definition."""
         if self._name is None:
-            self._name = 'v' + md5(json_encode(self.definition).encode('ascii')).hexdigest()
+            self._name = variable_name(self.definition)
         return self._name
 
     def rehash(self):
@@ -54,8 +214,20 @@ class SsiVariable(object):
         variables passed as arguments to {% ssi_include %}.
         """
         self._name = None
+        self._hash = None
         return self.name
 
+    def __eq__(self, other):
+        return isinstance(other, SsiVariable) and self.name == other.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.name)
+        return self._hash
+
     @property
     def definition(self):
         """Variable is defined by path to template tag and its arguments."""
@@ -71,9 +243,12 @@ class SsiVariable(object):
 
     def get_value(self, request):
         """Computes the real value of the variable, using the request."""
-        taglib, tagname = self.tagpath.rsplit('.', 1)
-        return template.get_library(taglib).tags[tagname].get_value(
-            request, *self.args, **self.kwargs)
+        value = get_memoized(request, self)
+        if value is NOT_FOUND:
+            value = get_tag(self.tagpath).get_value(
+                request, *self.args, **self.kwargs)
+            memoize(request, self, value)
+        return value
 
     def __str__(self):
         return mark_safe("<!--#echo var='%s' encoding='none'-->" % self.name)
@@ -93,11 +268,23 @@ setattr(SsiVariable, 'endif',
 
 class SsiExpect(object):
     """This class says: I want the real value of this variable here."""
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
+
     def __repr__(self):
         return "SsiExpect(%s)" % (self.name,)
 
+    def __eq__(self, other):
+        return isinstance(other, SsiExpect) and self.name == other.name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.name)
+
 
 def ssi_expect(var, type_):
     """
@@ -148,84 +335,469 @@ class SsiVariableNode(template.Node):
             return var
 
 
-def ssi_set_statement(var, value):
-    """Generates an SSI set statement for a variable."""
+_number_types = frozenset(six.integer_types + (float,))
+_set_prefixes = {}
+
+
+def _escaped_text(value):
     if isinstance(value, Promise):
         # Yes, this is quite brutal. But we need to know
         # the real value now, we don't know the type,
         # and we only want to evaluate the lazy function once.
         value = value._proxy____cast()
     if value is False or value is None:
-        value = ''
-    return "<!--#set var='%s' value='%s'-->" % (
-        var,
-        force_text(value).replace('\\', '\\\\').replace("'", "\\'"))
+        return ''
+    return force_text(value).replace('\\', '\\\\').replace("'", "\\'")
+
+
+def escaped_value(value):
+    """Returns the value escaped for an SSI set statement, as bytes."""
+    if type(value) in _number_types:
+        # Nothing to escape.
+        return str(value).encode('ascii')
+    return _escaped_text(value).encode('utf-8')
+
+
+def _nginx_length(escaped):
+    """
+    Returns the length of an escaped value, as counted by nginx.
+
+    nginx stores an escaped quote as the quote alone, but keeps
+    the escaping backslash before any other character.
+
+    """
+    return len(escaped) - escaped.count(b"'")
+
+
+def _set_prefix(var):
+    try:
+        return _set_prefixes[var]
+    except KeyError:
+        pass
+    prefix = ("<!--#set var='%s' value='" % var).encode('utf-8')
+    if len(_set_prefixes) >= conf.VARIABLE_NAMES_MAX_ENTRIES:
+        _set_prefixes.clear()
+    _set_prefixes[var] = prefix
+    return prefix
+
+
+def ssi_set_statement(var, value):
+    """Generates an SSI set statement for a variable."""
+    return "<!--#set var='%s' value='%s'-->" % (var, _escaped_text(value))
+
+
+def _dependencies(var):
+    """
+    Yields names of the variables needed directly to resolve `var`.
+
+    Nested variables need to be provided as well, so their own
+    dependencies are taken care of separately.
+
+    """
+    for arg in var.args:
+        if isinstance(arg, (SsiExpect, SsiVariable)):
+            yield arg.name
+    for arg in var.kwargs.values():
+        if isinstance(arg, (SsiExpect, SsiVariable)):
+            yield arg.name
+
+
+def _find_cycle(dependencies, unresolved):
+    """
+    Finds a dependency cycle among the unresolved variables.
+
+    Every unresolved variable depends on at least one other unresolved
+    variable, so just following the dependencies must lead to a cycle.
+
+    """
+    path = []
+    seen = {}
+    name = min(unresolved)
+    while name not in seen:
+        seen[name] = len(path)
+        path.append(name)
+        name = min(dep for dep in dependencies[name] if dep in unresolved)
+    return path[seen[name]:] + [name]
+
+
+def resolution_levels(request, ssi_vars, provided=()):
+    """
+    Orders the variables topologically by their dependencies.
+
+    Returns a list of levels, each one being a list of names of variables
+    depending only on the variables from previous levels. Dependencies
+    on variables with names in `provided` are considered satisfied.
+
+    """
+    dependencies = dict((name, set(dep for dep in _dependencies(var)
+                                   if dep not in provided))
+                        for name, var in ssi_vars.items())
+    dependants = dict((name, []) for name in dependencies)
+    missing = {}
+    for name, needed in dependencies.items():
+        for dep in needed:
+            if dep in dependants:
+                dependants[dep].append(name)
+            else:
+                missing.setdefault(dep, []).append(ssi_vars[name])
+    if missing:
+        raise SsiVarsDependencyMissingError(request, missing)
+
+    pending = dict((name, len(needed))
+                   for name, needed in dependencies.items())
+    level = [name for name, count in pending.items() if not count]
+    levels = []
+    while level:
+        levels.append(level)
+        next_level = []
+        for name in level:
+            del pending[name]
+            for dependant in dependants[name]:
+                pending[dependant] -= 1
+                if not pending[dependant]:
+                    next_level.append(dependant)
+        level = next_level
+
+    if pending:
+        resolved = [name for level in levels for name in level]
+        raise SsiVarsDependencyCycleError(
+            request, [ssi_vars[name] for name in pending], resolved,
+            _find_cycle(dependencies, pending))
+    return levels
+
+
+def _memo_key(var):
+    """Memo key is the name, if the variable can be named at all."""
+    try:
+        return var.name
+    except TypeError:
+        # Some argument isn't JSON-serializable.
+        return None
+
+
+def get_memoized(request, var):
+    """
+    Finds a value of the variable computed earlier, or returns NOT_FOUND.
+
+    The variable should have all the arguments already resolved
+    to real values.
+
+    """
+    key = _memo_key(var)
+    if key is None:
+        return NOT_FOUND
+    memo = request_memo(request)
+    value = memo.get(key)
+    if (value is NOT_FOUND and
+            get_tag(var.tagpath).shared_timeout is not None):
+        value = shared_memo.get(key)
+        if value is not NOT_FOUND:
+            memo.set(key, value)
+    return value
+
+
+def memoize(request, var, value):
+    """Remembers the computed value for the request, and maybe longer."""
+    key = _memo_key(var)
+    if key is None:
+        return
+    request_memo(request).set(key, value)
+    shared_timeout = get_tag(var.tagpath).shared_timeout
+    if shared_timeout is not None:
+        shared_memo.set(key, value, shared_timeout)
+
+
+def _is_dependency(arg):
+    return isinstance(arg, (SsiExpect, SsiVariable))
+
+
+def _has_dependencies(var):
+    return (any(_is_dependency(arg) for arg in var.args) or
+            any(_is_dependency(arg) for arg in var.kwargs.values()))
+
+
+def _fill_expects(arg, values, filled):
+    """
+    Replaces SsiExpects with the real values, also in nested variables.
+
+    Nested variables already resolved are taken from `filled`, keyed
+    by name, so that long chains aren't walked again for every variable.
+    Variables without any SsiExpects are returned as they are,
+    so their names don't need to be computed again.
+
+    """
+    if isinstance(arg, SsiExpect):
+        return values[arg.name]
+    elif isinstance(arg, SsiVariable):
+        try:
+            return filled[arg.name]
+        except KeyError:
+            pass
+        if not _has_dependencies(arg):
+            return arg
+        args = [_fill_expects(a, values, filled) for a in arg.args]
+        kwargs = dict((k, _fill_expects(v, values, filled))
+                      for k, v in arg.kwargs.items())
+        if (all(new is old for new, old in zip(args, arg.args)) and
+                all(kwargs[k] is v for k, v in arg.kwargs.items())):
+            return arg
+        return SsiVariable(arg.tagpath, args, kwargs)
+    else:
+        return arg
+
+
+def _fill_values(arg, values):
+    """Replaces SsiExpects and nested variables with the real values."""
+    if isinstance(arg, (SsiExpect, SsiVariable)):
+        return values[arg.name]
+    else:
+        return arg
 
 
-def provide_vars(request, ssi_vars):
+def resolve_levels(request, ssi_vars, levels, values, resolved):
+    """
+    Resolves the variables level by level, as a generator.
+
+    For every level of dependencies, it yields a dict of groups
+    of variables to compute, as lists of (args, kwargs) pairs keyed
+    by tagpath, and expects a dict of lists of their values to be sent
+    back. This way the same logic is used by both `provide_vars` and
+    its asynchronous version.
+
+    Values are collected in `values`, by the names the variables are
+    known by in ssi_vars, and in `resolved`, by their final names,
+    after filling in the SsiExpects.
+
+    """
+    # Variables with SsiExpects filled in, by name.
+    filled = {}
+    for level in levels:
+        final_names = {}
+        groups = {}
+        for name in level:
+            var = ssi_vars[name]
+            if _has_dependencies(var):
+                # Rename the variable after filling in the SsiExpects
+                # with real values, because that's what the included
+                # views expect.
+                filled[name] = _fill_expects(var, values, filled)
+                final_name = filled[name].name
+                valued = SsiVariable(
+                    var.tagpath,
+                    [_fill_values(arg, values) for arg in var.args],
+                    dict((k, _fill_values(v, values))
+                         for k, v in var.kwargs.items()))
+            else:
+                final_name = var.name
+                valued = var
+            final_names[name] = final_name
+            if final_name in resolved:
+                continue
+            value = get_memoized(request, valued)
+            if value is NOT_FOUND:
+                # Placeholder, so that we don't compute the variable twice.
+                resolved[final_name] = None
+                groups.setdefault(var.tagpath, []).append(
+                    (final_name, valued))
+            else:
+                resolved[final_name] = value
+
+        if groups:
+            computed = yield dict(
+                (tagpath, [(valued.args, valued.kwargs)
+                           for final_name, valued in group])
+                for tagpath, group in groups.items())
+            for tagpath, group in groups.items():
+                for (final_name, valued), value in zip(
+                        group, computed[tagpath]):
+                    memoize(request, valued, value)
+                    resolved[final_name] = value
+
+        for name, final_name in final_names.items():
+            values[name] = resolved[final_name]
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def _get_pool(threads):
+    with _pools_lock:
+        if threads not in _pools:
+            _pools[threads] = ThreadPool(threads)
+        return _pools[threads]
+
+
+def _compute(request, tagpath, calls):
+    """Computes values of a group of variables of the same kind."""
+    labels = {'variable': tagpath}
+    with metrics.timed('variable_seconds', labels):
+        values = get_tag(tagpath).get_values(request, calls)
+    metrics.increment('variables_computed_total', len(calls), labels)
+    return values
+
+
+def _compute_in_thread(args):
+    """
+    Computes a group in a pool thread.
+
+    Database connections of the thread are treated like those of
+    a request: they're kept for CONN_MAX_AGE seconds, and closed
+    when they become obsolete or unusable.
+
+    """
+    request, tagpath, calls, language = args
+    close_old_connections()
+    translation.activate(language)
+    try:
+        return _compute(request, tagpath, calls)
+    finally:
+        translation.deactivate()
+        close_old_connections()
+
+
+def compute_groups(request, groups):
+    """
+    Computes groups of variables, as yielded by `resolve_levels`.
+
+    Values of variables defined by `async def` functions are computed
+    concurrently, in an event loop.
+
+    If SSIFY_VARIABLE_THREADS is set, the other variables are computed
+    concurrently on a pool of that many threads: a call for every
+    variable, or for every group with a batch function. Variables
+    defined with `thread_safe=False` are always computed in the calling
+    thread.
+
+    """
+    computed = {}
+    async_groups = {}
+    tasks = []
+    threads = conf.VARIABLE_THREADS
+    for tagpath, calls in groups.items():
+        tag = get_tag(tagpath)
+        if tag.is_async:
+            async_groups[tagpath] = calls
+        elif threads and tag.thread_safe:
+            if tag.batch is None:
+                tasks.extend((tagpath, [call]) for call in calls)
+            else:
+                tasks.append((tagpath, calls))
+        else:
+            computed[tagpath] = _compute(request, tagpath, calls)
+
+    if len(tasks) > 1:
+        language = translation.get_language()
+        result = _get_pool(threads).map_async(
+            _compute_in_thread,
+            [(request, tagpath, calls, language) for tagpath, calls in tasks])
+    else:
+        result = None
+        for tagpath, calls in tasks:
+            computed[tagpath] = _compute(request, tagpath, calls)
+
+    if async_groups:
+        from .asynchronous import run_gather_values
+        computed.update(run_gather_values(request, async_groups))
+
+    if result is not None:
+        for (tagpath, calls), values in zip(tasks, result.get()):
+            computed.setdefault(tagpath, []).extend(values)
+    return computed
+
+
+def _truncate(escaped, limit):
+    """
+    Cuts an escaped value down to `limit` bytes, as nginx counts them.
+
+    Escape sequences and UTF-8 characters are never split.
+
+    """
+    text = escaped.decode('utf-8')
+    length = 0
+    i = 0
+    while i < len(text):
+        if text[i] == '\\':
+            step, size = 2, 1 if text[i + 1] == "'" else 2
+        else:
+            step, size = 1, len(text[i].encode('utf-8'))
+        if length + size > limit:
+            break
+        length += size
+        i += step
+    return text[:i].encode('utf-8')
+
+
+def set_statements(request, resolved):
+    """
+    Returns the SSI set statements for the resolved values, as bytes.
+
+    nginx refuses to set values longer than SSIFY_SSI_VALUE_LENGTH
+    (as it counts them). Such values are truncated, with a warning,
+    or raise SsiValueTooLongError if SSIFY_SSI_VALUE_TOO_LONG is 'raise'.
+
+    """
+    limit = conf.SSI_VALUE_LENGTH
+    parts = []
+    for var, value in resolved.items():
+        escaped = escaped_value(value)
+        if len(escaped) > limit:
+            length = _nginx_length(escaped)
+            if length > limit:
+                error = SsiValueTooLongError(
+                    request, var, escaped.decode('utf-8'), length, limit)
+                if conf.SSI_VALUE_TOO_LONG == 'raise':
+                    raise error
+                logger.warning('%sThe value is truncated.', error)
+                escaped = _truncate(escaped, limit)
+        parts.append(_set_prefix(var))
+        parts.append(escaped)
+        parts.append(b"'-->")
+    return b"".join(parts)
+
+
+def provide_vars(request, ssi_vars, levels=None, values=None):
     """
     Provides all the SSI set statements for ssi_vars variables.
 
     The main purpose of this function is to by called by SsifyMiddleware.
-    """
-    def resolve_expects(var):
-        if not hasattr(var, 'hash_dirty'):
-            var.hash_dirty = False
+    If the levels of dependencies are already known (as returned by
+    `resolution_levels`), they can be passed in `levels`.
 
-        for i, arg in enumerate(var.args):
-            if isinstance(arg, SsiExpect):
-                var.args[i] = resolved[arg.name]
-                var.hash_dirty = True
-        for k, arg in var.kwargs.items():
-            if isinstance(arg, SsiExpect):
-                var.kwargs[k] = resolved[arg.name]
-                var.hash_dirty = True
+    Values of the variables provided before can be passed in `values`,
+    a dict keyed by variable name. It's updated with the values
+    of the newly provided variables.
 
-        for arg in var.args + list(var.kwargs.values()):
-            if isinstance(arg, SsiVariable):
-                var.hash_dirty = resolve_expects(arg) or var.hash_dirty
-
-        hash_dirty = var.hash_dirty
-        if var.hash_dirty:
-            # Rehash after calculating the SsiExpects with real
-            # values, because that's what the included views expect.
-            var.rehash()
-            var.hash_dirty = False
-
-        return hash_dirty
-
-    def resolve_args(var):
-        kwargs = {}
-        for k, arg in var.kwargs.items():
-            kwargs[k] = resolved[arg.name] if isinstance(arg, SsiVariable) else arg
-        new_var = SsiVariable(var.tagpath,
-            [resolved[arg.name] if isinstance(arg, SsiVariable) else arg for arg in var.args],
-            kwargs)
-        return new_var
+    Variables are resolved in topological order of their dependencies,
+    so that every variable is computed exactly once. Variables on
+    the same level of dependencies are grouped by the defining tag,
+    so that tags with batch functions are called once for each group.
+    Values computed earlier in the request, or shared across requests,
+    are taken from the memos.
 
+    """
+    collector = metrics.get_collector()
+    if collector is not None:
+        start = time.time()
+    if values is None:
+        values = {}
     resolved = {}
-    queue = list(ssi_vars.values())
-    
-    unresolved_streak = 0
-    while queue:
-        var = queue.pop(0)
-        try:
-            resolve_expects(var)
-            rv = resolve_args(var)
-        except KeyError as e:
-            queue.append(var)
-            unresolved_streak += 1
-            if unresolved_streak > len(queue):
-                raise SsiVarsDependencyCycleError(request, queue, resolved)
-            continue
-
-        resolved[var.name] = rv.get_value(request)
-        unresolved_streak = 0
-
-    output = "".join(ssi_set_statement(var, value)
-                      for (var, value) in resolved.items()
-                      ).encode('utf-8')
+    if levels is None:
+        levels = resolution_levels(request, ssi_vars, values)
+
+    steps = resolve_levels(request, ssi_vars, levels, values, resolved)
+    try:
+        groups = next(steps)
+        while True:
+            groups = steps.send(compute_groups(request, groups))
+    except StopIteration:
+        pass
+
+    output = set_statements(request, resolved)
+    if collector is not None:
+        collector.observe('provide_vars_seconds', time.time() - start)
+        collector.observe('page_variables', len(resolved))
     return output
 
 
-from .serializers import json_encode
+from .serializers import json_encode_definition
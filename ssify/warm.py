@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+"""
+Pre-rendering of SSI included views into the caches.
+
+Used by the `ssify_warm` management command. All the URL patterns
+of `ssi_included` views are found, and their paths are generated
+in all the languages. Patterns taking other keyword arguments are
+only warmed if the view gives a `warm_kwargs` function to generate
+them.
+
+Paths are rendered by Django's WSGI handler, just as if requested
+by the webserver, so the contents end up in the caches, and the usual
+per-request cleanup (like closing database connections) is done.
+
+"""
+from __future__ import unicode_literals
+from io import BytesIO
+import sys
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.urlresolvers import get_resolver, NoReverseMatch
+from django.db import connections
+from django.utils import six
+from .cache import view_paths
+
+
+def included_patterns(patterns=None, namespaces=(), prefix=''):
+    """
+    Yields (view, pattern, regex) for all the `ssi_included` views.
+
+    The view is either a URL name (with namespaces), or the callback,
+    for patterns without names. The regex matches the whole path,
+    without the leading slash.
+
+    """
+    if patterns is None:
+        patterns = get_resolver(None).url_patterns
+    for pattern in patterns:
+        regex = prefix + pattern.regex.pattern.lstrip('^')
+        if hasattr(pattern, 'url_patterns'):
+            sub_namespaces = namespaces
+            if pattern.namespace:
+                sub_namespaces += (pattern.namespace,)
+            for included in included_patterns(
+                    pattern.url_patterns, sub_namespaces, regex):
+                yield included
+        elif hasattr(pattern.callback, 'warm_kwargs'):
+            if pattern.name:
+                view = ':'.join(namespaces + (pattern.name,))
+            else:
+                view = pattern.callback
+            yield view, pattern, regex
+
+
+def pattern_paths(view, pattern):
+    """Yields all the paths to warm for the pattern."""
+    params = set(pattern.regex.groupindex) - set(['lang'])
+    warm_kwargs = pattern.callback.warm_kwargs
+    if warm_kwargs is not None:
+        kwargs_list = warm_kwargs()
+    elif params:
+        # We don't know what to put there.
+        return
+    else:
+        kwargs_list = [{}]
+    for kwargs in kwargs_list:
+        try:
+            for path in sorted(view_paths(view, kwargs)):
+                yield path
+        except NoReverseMatch:
+            pass
+
+
+def warm_paths():
+    """Yields the paths of all the `ssi_included` views to warm."""
+    for view, pattern, regex in included_patterns():
+        for path in pattern_paths(view, pattern):
+            yield path
+
+
+def default_host():
+    """Returns the first host name explicitly allowed in settings."""
+    for host in getattr(settings, 'ALLOWED_HOSTS', []):
+        if not host.startswith(('*', '.')):
+            return host
+    return 'localhost'
+
+
+_handler = []
+
+
+def close_connections():
+    """Closes database connections, so they're not shared by processes."""
+    for connection in connections.all():
+        connection.close()
+
+
+def init_worker(host=None):
+    """Prepares a process for rendering."""
+    _handler[:] = [WSGIHandler(), host or default_host()]
+
+
+def _wsgi_str(value):
+    """WSGI wants native strings, with bytes decoded as latin-1 on py3."""
+    value = value.encode('utf-8')
+    return value if six.PY2 else value.decode('iso-8859-1')
+
+
+def _environ(path, host):
+    path, query = (_wsgi_str(path).split(str('?'), 1) + [str('')])[:2]
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': _wsgi_str(host),
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': _wsgi_str(host),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multiprocess': True,
+        'wsgi.multithread': False,
+        'wsgi.run_once': False,
+    }
+
+
+def render_path(path):
+    """Renders the path, returning (path, status code)."""
+    if not _handler:
+        init_worker()
+    handler, host = _handler
+    status = []
+    response = handler(_environ(path, host),
+                       lambda code, headers, exc_info=None: status.append(
+                           int(code.split(' ', 1)[0])))
+    try:
+        for chunk in response:
+            pass
+    finally:
+        # Sends request_finished.
+        response.close()
+    return path, status[0]
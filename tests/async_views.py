@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+# Python 3.5+ only.
+#
+from __future__ import unicode_literals
+from django.http import HttpResponse
+from ssify import SsiVariable as V
+
+
+SLOW_ONE = V('async_tags.slow_double', [1])
+SLOW_DOUBLE = V('async_tags.slow_double', [SLOW_ONE])
+
+
+async def get_response(request):
+    """Stands for the rest of an asynchronous middleware chain."""
+    request.ssi_vars_needed = {SLOW_ONE.name: SLOW_ONE,
+                               SLOW_DOUBLE.name: SLOW_DOUBLE}
+    return HttpResponse(b'content')
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+from django.db import models
+
+
+class Book(models.Model):
+    title = models.CharField(max_length=255)
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+# Python 3.5+ only.
+#
+from __future__ import unicode_literals
+import asyncio
+from django import template
+from ssify import ssi_variable
+
+register = template.Library()
+
+
+@ssi_variable(register)
+async def slow_double(request, number):
+    await asyncio.sleep(.2)
+    return number * 2
+
+
+async def slow_triples(request, arg_tuples):
+    await asyncio.sleep(.2)
+    return [number * 3 for (number,) in arg_tuples]
+
+
+@ssi_variable(register, batch=slow_triples)
+async def slow_triple(request, number):
+    return number * 3
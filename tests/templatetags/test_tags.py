@@ -3,6 +3,8 @@
 # Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
 #
 from __future__ import unicode_literals
+from threading import current_thread
+import time
 from django import template
 from ssify import ssi_variable
 from tests.views import QUOTES
@@ -24,3 +26,41 @@ def number_of_quotes(request):
 @ssi_variable(register)
 def quote_len_odd(request, which):
     return bool(len(QUOTES[which]) % 1)
+
+
+quote_len_batches = []
+
+
+def quote_lens(request, arg_tuples):
+    quote_len_batches.append(arg_tuples)
+    return [len(QUOTES[which]) for (which,) in arg_tuples]
+
+
+@ssi_variable(register, batch=quote_lens)
+def quote_len(request, which):
+    return len(QUOTES[which])
+
+
+shared_counter_calls = []
+
+
+@ssi_variable(register, shared_timeout=60)
+def shared_counter(request):
+    shared_counter_calls.append(request)
+    return len(shared_counter_calls)
+
+
+slow_threads = []
+
+
+@ssi_variable(register)
+def slow_square(request, number):
+    slow_threads.append(('slow_square', current_thread().name))
+    time.sleep(.2)
+    return number * number
+
+
+@ssi_variable(register, thread_safe=False)
+def unsafe_number(request, number):
+    slow_threads.append(('unsafe_number', current_thread().name))
+    return number
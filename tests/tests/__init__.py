@@ -13,4 +13,14 @@ from __future__ import unicode_literals
 from .test_args import *
 from .test_basic import *
 from .test_csrf import *
-from .test_locale import *
\ No newline at end of file
+from .test_locale import *
+from .test_variables import *
+from .test_manifest import *
+from .test_streaming import *
+from .test_render import *
+from .test_cache import *
+from .test_warm import *
+from .test_nginx import *
+from .test_includes import *
+from .test_metrics import *
+from .test_async import *
@@ -14,26 +14,26 @@ class ArgsTestCase(TestCase):
     def test_args(self):
         self.assertEqual(
             sorted(split_ssi(self.client.get('/args').content)),
-            sorted([b"<!--#set var='vff80027f1d552d08d46c8b603948d85c' value='2'-->",
-                 b"<!--#set var='veeb5ec4364971b409c48e36bd1428d03' value='1'-->",
-                 b"<!--#set var='v05a1f9ec205c5aa84197f6b326c518a2' value='0'-->",
-                 b"<!--#echo var='v05a1f9ec205c5aa84197f6b326c518a2' encoding='none'-->",
+            sorted([b"<!--#set var='v4cef972c2db42f84d7238fdc963a6b88' value='2'-->",
+                 b"<!--#set var='vc8d8a3fa8bd88e6ded209d7131f8de54' value='1'-->",
+                 b"<!--#set var='v7ebec9ec8f2b40d9c9f8d0a4647c6da8' value='0'-->",
+                 b"<!--#echo var='v7ebec9ec8f2b40d9c9f8d0a4647c6da8' encoding='none'-->",
                  ])
             )
 
     def test_args_included(self):
         self.assertEqual(
             self.client.get('/args/3').content.strip(),
-            b"<!--#echo var='v05a1f9ec205c5aa84197f6b326c518a2' encoding='none'-->"
+            b"<!--#echo var='v7ebec9ec8f2b40d9c9f8d0a4647c6da8' encoding='none'-->"
             )
 
     def test_include_args(self):
         self.assertEqual(
             sorted(split_ssi(self.client.get('/include_args').content)),
             sorted([b"<!--#set var='vf6aba0780227af845107c046f336cc8a' value='3'-->",
-                 b"<!--#set var='vff80027f1d552d08d46c8b603948d85c' value='2'-->",
-                 b"<!--#set var='veeb5ec4364971b409c48e36bd1428d03' value='1'-->",
-                 b"<!--#set var='v05a1f9ec205c5aa84197f6b326c518a2' value='0'-->",
+                 b"<!--#set var='v4cef972c2db42f84d7238fdc963a6b88' value='2'-->",
+                 b"<!--#set var='vc8d8a3fa8bd88e6ded209d7131f8de54' value='1'-->",
+                 b"<!--#set var='v7ebec9ec8f2b40d9c9f8d0a4647c6da8' value='0'-->",
                  b"<!--#include file='/args/${vf6aba0780227af845107c046f336cc8a}'-->",
                  ]),
             )
@@ -42,9 +42,9 @@ class ArgsTestCase(TestCase):
         self.assertEqual(
             sorted(split_ssi(self.client.get('/include_args').content)),
             sorted([b"<!--#set var='vf6aba0780227af845107c046f336cc8a' value='3'-->",
-                 b"<!--#set var='vff80027f1d552d08d46c8b603948d85c' value='2'-->",
-                 b"<!--#set var='veeb5ec4364971b409c48e36bd1428d03' value='1'-->",
-                 b"<!--#set var='v05a1f9ec205c5aa84197f6b326c518a2' value='0'-->",
+                 b"<!--#set var='v4cef972c2db42f84d7238fdc963a6b88' value='2'-->",
+                 b"<!--#set var='vc8d8a3fa8bd88e6ded209d7131f8de54' value='1'-->",
+                 b"<!--#set var='v7ebec9ec8f2b40d9c9f8d0a4647c6da8' value='0'-->",
                  b"<!--#include file='/args/${vf6aba0780227af845107c046f336cc8a}'-->",
                  ]),
             )
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+import sys
+import time
+from unittest import skipIf
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+from ssify import SsiVariable as V
+from ssify.middleware import SsiMiddleware
+from ssify.variables import provide_vars
+from tests.views import QUOTES
+
+
+class NewStyleMiddlewareTestCase(TestCase):
+    def test_call(self):
+        var = V('test_tags.number_of_quotes')
+
+        def view(request):
+            request.ssi_vars_needed[var.name] = var
+            return HttpResponse(b'content')
+
+        def get_response(request):
+            middleware.process_view(request, view, (), {})
+            return view(request)
+
+        middleware = SsiMiddleware(get_response)
+        response = middleware(RequestFactory().get('/'))
+        self.assertEqual(
+            response.content,
+            ("<!--#set var='%s' value='%d'-->content" % (
+                var.name, len(QUOTES))).encode('ascii'))
+
+
+@skipIf(sys.version_info < (3, 5), 'Needs async def.')
+class AsyncVariablesTestCase(TestCase):
+    def setUp(self):
+        self.vars = [
+            V('async_tags.slow_double', [1]),
+            V('async_tags.slow_double', [2]),
+            V('async_tags.slow_triple', [1]),
+            V('async_tags.slow_triple', [2]),
+            V('test_tags.number_of_quotes'),
+        ]
+        self.vars.append(V('async_tags.slow_double', [self.vars[0]]))
+        self.ssi_vars = dict((var.name, var) for var in self.vars)
+
+    def assertProvided(self, output):
+        for var, value in zip(self.vars, (2, 4, 3, 6, len(QUOTES), 4)):
+            self.assertIn(
+                ("<!--#set var='%s' value='%d'-->" % (var.name, value)
+                 ).encode('ascii'), output)
+
+    def test_provide_vars(self):
+        start = time.time()
+        output = provide_vars(RequestFactory().get('/'), self.ssi_vars)
+        # Two levels of dependencies.
+        self.assertLess(time.time() - start, .6)
+        self.assertProvided(output)
+
+    def test_aprovide_vars(self):
+        import asyncio
+        from ssify.asynchronous import aprovide_vars
+        loop = asyncio.new_event_loop()
+        try:
+            output = loop.run_until_complete(
+                aprovide_vars(RequestFactory().get('/'), self.ssi_vars))
+        finally:
+            loop.close()
+        self.assertProvided(output)
+
+    def test_async_middleware(self):
+        import asyncio
+        from tests.async_views import get_response, SLOW_DOUBLE
+        middleware = SsiMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        loop = asyncio.new_event_loop()
+        try:
+            response = loop.run_until_complete(
+                middleware(RequestFactory().get('/')))
+        finally:
+            loop.close()
+        self.assertTrue(response.content.endswith(b'content'))
+        self.assertIn(
+            ("var='%s' value='4'" % SLOW_DOUBLE.name).encode('ascii'),
+            response.content)
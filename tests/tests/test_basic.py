@@ -51,7 +51,7 @@ Line 3 of <!--#echo var='va50d914691ecf9b421c680d93ba1263e' encoding='none'-->
         self.assertEqual(
             sorted(split_ssi(self.client.get('/').content)),
             sorted([b"<!--#set var='va50d914691ecf9b421c680d93ba1263e' value='22'-->",
-                 b"<!--#set var='v3e7f638af74c9f420b6d2c5fe4dda51d' value='4'-->",
+                 b"<!--#set var='ve5c36b96d4e99e5853b7fae1e2066423' value='4'-->",
                  b"<!--#set var='vafe010f2e683908fee32c48d01bb2650' value=''-->",
                  b"<!--#include file='/random_quote'-->"])
         )
@@ -60,14 +60,14 @@ Line 3 of <!--#echo var='va50d914691ecf9b421c680d93ba1263e' encoding='none'-->
         self.assertEqual(
             sorted(split_ssi(self.client.get('/').content)),
             sorted([b"<!--#set var='va50d914691ecf9b421c680d93ba1263e' value='22'-->",
-                 b"<!--#set var='v3e7f638af74c9f420b6d2c5fe4dda51d' value='4'-->",
+                 b"<!--#set var='ve5c36b96d4e99e5853b7fae1e2066423' value='4'-->",
                  b"<!--#set var='vafe010f2e683908fee32c48d01bb2650' value=''-->",
                  b"<!--#include file='/random_quote'-->"])
         )
         self.assertEqual(
             self.client.get('/random_quote').content.strip(),
             b"<!--#include "
-            b"file='/quote/${v3e7f638af74c9f420b6d2c5fe4dda51d}'-->"
+            b"file='/quote/${ve5c36b96d4e99e5853b7fae1e2066423}'-->"
         )
 
     @override_settings(SSIFY_RENDER=True)
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+from hashlib import md5
+import os
+import shutil
+import stat
+import tempfile
+import zlib
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.test.utils import override_settings
+from ssify.cache_backends import StaticFileBasedCache
+from ssify.compression import is_compressed
+from ssify import dependencies, exceptions, registry, stale
+from tests import views
+from tests.models import Book
+from ssify.cache import (cache_include, flush_ssi_includes, get_cache,
+                         get_cache_aliases, get_caches, get_many_includes,
+                         include_timeout, set_many_includes)
+
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'a': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+          'LOCATION': 'a'},
+    'b': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+          'LOCATION': 'b'},
+    'registry': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                 'LOCATION': 'registry',
+                 'OPTIONS': {'MAX_ENTRIES': 100000}},
+}
+
+
+@override_settings(CACHES=CACHES, SSIFY_CACHE_ALIASES=['a', 'b'])
+class CacheTestCase(TestCase):
+    def setUp(self):
+        for cache in get_caches():
+            cache.clear()
+
+    def test_aliases(self):
+        self.assertEqual(get_cache_aliases(), ['a', 'b'])
+        self.assertIs(get_caches(), get_caches())
+        with self.settings(SSIFY_CACHE_ALIASES=None):
+            self.assertEqual(get_cache_aliases(), ['default'])
+
+    def test_get_many_includes(self):
+        get_cache('a').set('/x', b'X')
+        get_cache('b').set('/x', b'old X')
+        get_cache('b').set('/y', b'Y')
+        self.assertEqual(get_many_includes(['/x', '/y', '/z']),
+                         {'/x': b'X', '/y': b'Y'})
+
+    def _test_set_many_includes(self):
+        set_many_includes({'/x': b'X', '/y': b'Y'})
+        for alias in 'a', 'b':
+            self.assertEqual(get_cache(alias).get_many(['/x', '/y']),
+                             {'/x': b'X', '/y': b'Y'})
+
+    def test_set_many_includes(self):
+        self._test_set_many_includes()
+
+    @override_settings(SSIFY_CACHE_WRITE='concurrent')
+    def test_set_many_includes_concurrent(self):
+        self._test_set_many_includes()
+
+    @override_settings(SSIFY_CACHE_COMPRESS=['b'],
+                       SSIFY_CACHE_COMPRESS_MIN_LENGTH=10)
+    def test_compress(self):
+        long_content = b'<p>Content</p>' * 100
+        set_many_includes({'/x': b'X', '/y': long_content})
+        self.assertEqual(get_cache('b').get('/x'), b'X')
+        compressed = get_cache('b').get('/y')
+        self.assertTrue(is_compressed(compressed))
+        self.assertLess(len(compressed), len(long_content) / 4)
+        self.assertEqual(get_cache('a').get('/y'), long_content)
+        get_cache('a').clear()
+        self.assertEqual(get_many_includes(['/x', '/y']),
+                         {'/x': b'X', '/y': long_content})
+
+    def test_compress_misconfigured(self):
+        with self.settings(SSIFY_CACHE_COMPRESS=['c']):
+            self.assertRaises(ImproperlyConfigured, get_caches)
+        with self.settings(SSIFY_CACHE_COMPRESS=['a'], CACHES=dict(CACHES, a={
+                'BACKEND': 'ssify.cache_backends.StaticFileBasedCache',
+                'LOCATION': '/tmp/ssify-test-never-written'})):
+            self.assertRaises(ImproperlyConfigured, get_caches)
+
+
+@override_settings(CACHES=CACHES, SSIFY_CACHE_ALIASES=['a', 'b'],
+                   SSIFY_REGISTRY_CACHE='registry')
+class FlushTestCase(TestCase):
+    def setUp(self):
+        for alias in CACHES:
+            get_cache(alias).clear()
+        for path in '/a/1', '/a/2', '/ab', '/b/1':
+            cache_include(path, b'content', tags=['tag' + path[1]])
+        get_cache('a').set('other', 'data')
+
+    def assertCached(self, paths):
+        for alias in 'a', 'b':
+            self.assertEqual(
+                sorted(get_cache(alias).get_many(
+                    ['/a/1', '/a/2', '/ab', '/b/1'])),
+                paths)
+
+    def test_flush_everything(self):
+        flush_ssi_includes()
+        self.assertCached([])
+        self.assertEqual(get_cache('a').get('other'), 'data')
+
+    def test_flush_prefix(self):
+        flush_ssi_includes(prefix='/a/')
+        self.assertCached(['/ab', '/b/1'])
+        flush_ssi_includes(prefix='/a')
+        self.assertCached(['/b/1'])
+
+    def test_flush_tags(self):
+        flush_ssi_includes(tags=['taga'])
+        self.assertCached(['/b/1'])
+
+    def test_flush_view(self):
+        self.client.get('/quote/3')
+        self.client.get('/language/pl')
+        self.client.get('/language/de')
+        self.assertEqual(
+            sorted(get_cache('a').get_many(
+                ['/quote/3', '/language/pl', '/language/de'])),
+            ['/language/de', '/language/pl', '/quote/3'])
+        flush_ssi_includes(view='language_with_lang')
+        flush_ssi_includes(view='quote', kwargs={'number': 3})
+        self.assertEqual(
+            get_cache('a').get_many(
+                ['/quote/3', '/language/pl', '/language/de']),
+            {})
+
+    def test_flush_view_tags(self):
+        self.client.get('/quote/3')
+        self.assertIsNotNone(get_cache('a').get('/quote/3'))
+        flush_ssi_includes(tags=['quote:3'])
+        self.assertIsNone(get_cache('a').get('/quote/3'))
+        self.assertCached(['/a/1', '/a/2', '/ab', '/b/1'])
+
+    def test_no_registry(self):
+        with self.settings(SSIFY_REGISTRY_CACHE=None):
+            self.assertRaises(ImproperlyConfigured,
+                              flush_ssi_includes, tags=['taga'])
+            flush_ssi_includes()
+        self.assertCached([])
+        self.assertIsNone(get_cache('a').get('other'))
+
+    def test_flush_dependants(self):
+        first = Book.objects.create(title='First')
+        second = Book.objects.create(title='Second')
+        paths = ['/book/%d' % first.pk, '/book/%d' % second.pk, '/books']
+        for path in paths:
+            self.client.get(path)
+        self.assertEqual(sorted(get_cache('a').get_many(paths)), paths)
+
+        first.title = 'Changed'
+        first.save()
+        self.assertEqual(sorted(get_cache('a').get_many(paths)),
+                         ['/book/%d' % second.pk])
+        self.assertCached(['/a/1', '/a/2', '/ab', '/b/1'])
+
+        self.client.get('/book/%d' % first.pk)
+        self.assertEqual(get_cache('a').get('/book/%d' % first.pk),
+                         b'Changed')
+        second.delete()
+        self.assertEqual(sorted(get_cache('a').get_many(paths)),
+                         ['/book/%d' % first.pk])
+
+
+    def test_unwatched_model(self):
+        calls = []
+        flush = dependencies.flush_ssi_includes
+        dependencies.flush_ssi_includes = lambda **kwargs: calls.append(kwargs)
+        try:
+            Book.objects.create(title='Nobody depends on it')
+            self.assertEqual(calls, [])
+            # A dependant was seen by another process.
+            registry.mark_model('tests.book')
+            Book.objects.create(title='Watched')
+            self.assertEqual(len(calls), 1)
+        finally:
+            dependencies.flush_ssi_includes = flush
+
+    def test_evicted_mark(self):
+        book = Book.objects.create(title='Title')
+        self.client.get('/books')
+        get_cache('registry').delete(registry.MODEL_KEY % 'tests.book')
+        # Rendering another dependant in the same process marks it again.
+        self.client.get('/book/%d' % book.pk)
+        book.save()
+        self.assertEqual(
+            get_cache('a').get_many(['/books', '/book/%d' % book.pk]), {})
+
+
+@override_settings(CACHES=CACHES, SSIFY_REGISTRY_CACHE='registry')
+class RegistryTestCase(TestCase):
+    def setUp(self):
+        get_cache('registry').clear()
+
+    def test_large_set(self):
+        paths = set('/big/%d' % i for i in range(2500))
+        registry.register(paths, tags=['big'])
+        registry.register(['/big/x'], tags=['big'])
+        # Written in slots, no slot bigger than SLOT_SIZE.
+        count_key = registry.COUNT_KEY % (
+            registry.TAG % registry._hashed('big'), 0)
+        self.assertEqual(get_cache('registry').get(count_key), 4)
+        self.assertEqual(registry.tagged(['big']), paths | set(['/big/x']))
+        self.assertEqual(registry.with_prefix('/big/'),
+                         paths | set(['/big/x']))
+
+    def test_registered_once(self):
+        registry.register(['/a/1'], tags=['t'])
+        registry.register(['/a/1', '/a/2'], tags=['t'])
+        registry.register(['/a/2'], tags=['t'])
+        stored = get_cache('registry').get_many([
+            registry.SLOT_KEY % (registry.TAG % registry._hashed('t'), 0, i)
+            for i in range(1, 4)])
+        self.assertEqual(sorted(stored.values()), [['/a/1'], ['/a/2']])
+
+    def test_forget(self):
+        registry.register(['/a/1'], tags=['t'])
+        registry.forget_tags(['t'])
+        self.assertEqual(registry.tagged(['t']), set())
+        registry.register(['/a/1'], tags=['t'])
+        self.assertEqual(registry.tagged(['t']), set(['/a/1']))
+        registry.clear()
+        self.assertEqual(registry.all_paths(), set())
+
+
+@override_settings(CACHES=CACHES, SSIFY_CACHE_ALIASES=['a'])
+class StaleTestCase(TestCase):
+    def setUp(self):
+        for alias in CACHES:
+            get_cache(alias).clear()
+
+    def test_stale_while_revalidate(self):
+        first = self.client.get('/renders').content
+        self.assertEqual(get_cache('a').get('/renders'), first)
+        self.assertEqual(stale.get('/renders'), first)
+
+        # The include expires, and someone else starts rendering it.
+        get_cache('a').clear()
+        self.assertTrue(stale.acquire('/renders'))
+        self.assertEqual(self.client.get('/renders').content, first)
+        self.assertIsNone(get_cache('a').get('/renders'))
+
+        stale.release('/renders')
+        second = self.client.get('/renders').content
+        self.assertNotEqual(second, first)
+        self.assertEqual(get_cache('a').get('/renders'), second)
+        self.assertEqual(stale.get('/renders'), second)
+        self.assertTrue(stale.acquire('/renders'))
+
+    def test_release_on_error(self):
+        with self.assertRaises(exceptions.UndeclaredSsiVarsError):
+            self.client.get('/stale_undeclared')
+        self.assertTrue(stale.acquire('/stale_undeclared'))
+
+    def test_flush(self):
+        first = self.client.get('/renders').content
+        flush_ssi_includes(['/renders'])
+        self.assertIsNone(stale.get('/renders'))
+
+        self.client.get('/renders')
+        flush_ssi_includes()
+        self.assertIsNone(stale.get('/renders'))
+        # Someone else is rendering it, there's no stale copy to serve.
+        self.assertTrue(stale.acquire('/renders'))
+        self.assertNotEqual(self.client.get('/renders').content, first)
+
+    def test_include_timeout(self):
+        self.assertEqual(include_timeout(), 300)
+        self.assertEqual(include_timeout(50), 50)
+        with self.settings(CACHES=dict(CACHES, a=dict(
+                CACHES['a'], TIMEOUT=1000))):
+            self.assertEqual(include_timeout(), 1000)
+        with self.settings(SSIFY_CACHE_ALIASES=['a', 'static'],
+                           CACHES=dict(CACHES, static={
+                               'BACKEND':
+                               'ssify.cache_backends.StaticFileBasedCache',
+                               'LOCATION': '/tmp/ssify-test-never-written'})):
+            self.assertIsNone(include_timeout())
+
+    def test_no_stale_copy(self):
+        self.assertTrue(stale.acquire('/renders'))
+        count = views.renders.count
+        self.client.get('/renders')
+        self.assertEqual(views.renders.count, count + 1)
+
+
+class StaticFileBasedCacheTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_set(self):
+        cache = StaticFileBasedCache(self.dir, {
+            'OPTIONS': {'FSYNC': 'full', 'FILE_MODE': 0o640}})
+        cache.set('/some/path', b'content')
+        cache.set('/some/path', b'new content')
+        self.assertEqual(cache.get('/some/path'), b'new content')
+        # No temporary files left.
+        self.assertEqual(os.listdir(os.path.join(self.dir, 'some')),
+                         ['path'])
+        self.assertEqual(
+            stat.S_IMODE(os.stat(
+                os.path.join(self.dir, 'some/path')).st_mode),
+            0o640)
+
+    def test_existing_dir(self):
+        cache = StaticFileBasedCache(self.dir, {})
+        os.makedirs(os.path.join(self.dir, 'some'))
+        cache.set('/some/path', b'content')
+        self.assertEqual(cache.get('/some/path'), b'content')
+
+    def test_keys(self):
+        cache = StaticFileBasedCache(self.dir, {})
+        for key in '/', '/a', '/b/', '/b/c':
+            cache.set(key, b'content')
+        self.assertTrue(
+            os.path.exists(os.path.join(self.dir, 'b/index.html')))
+        self.assertEqual(cache.keys(), ['/', '/a', '/b/', '/b/c'])
+        cache.delete('/a')
+        self.assertFalse(cache.has_key('/a'))
+        self.assertEqual(cache.keys(), ['/', '/b/', '/b/c'])
+        cache.clear()
+        self.assertEqual(cache.keys(), [])
+
+    def test_hashed(self):
+        cache = StaticFileBasedCache(self.dir, {
+            'OPTIONS': {'LAYOUT': 'hashed'}})
+        for key in '/', '/a', '/b/', '/b/c', '/a':
+            cache.set(key, key.encode('ascii'))
+        self.assertEqual(cache.get('/b/c'), b'/b/c')
+        digest = md5(b'/b/c').hexdigest()
+        self.assertTrue(os.path.exists(os.path.join(
+            self.dir, digest[:2], digest[2:4], digest)))
+        self.assertEqual(sorted(os.listdir(self.dir))[0], '.ssify-index')
+        self.assertEqual(cache.keys(), ['/', '/a', '/b/', '/b/c'])
+
+        cache.delete('/a')
+        cache.compact_index()
+        with open(os.path.join(self.dir, '.ssify-index'), 'rb') as index:
+            self.assertEqual(index.read(), b'/\n/b/\n/b/c\n')
+
+        cache.clear()
+        self.assertEqual(cache.keys(), [])
+        self.assertIsNone(cache.get('/b/c'))
+
+    def test_index_generation(self):
+        cache = StaticFileBasedCache(self.dir, {'OPTIONS': {'INDEX': True}})
+        cache.set('/a', b'A')
+        cache.set('/b', b'B')
+        # Another process removes the file, and the index is compacted.
+        os.remove(os.path.join(self.dir, 'a'))
+        cache.compact_index()
+        with open(os.path.join(self.dir, '.ssify-index.lock'), 'rb') as lock:
+            self.assertEqual(lock.read(), b'1')
+        # The key is indexed again, even though this process has seen it.
+        cache.set('/a', b'A')
+        self.assertEqual(cache.keys(), ['/a', '/b'])
+        cache.clear()
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'a')))
+        self.assertEqual(cache.keys(), [])
+
+    def test_gzip_static(self):
+        cache = StaticFileBasedCache(self.dir, {
+            'OPTIONS': {'GZIP_STATIC': True, 'GZIP_MIN_LENGTH': 10,
+                        'GZIP_LEVEL': 1}})
+        long_content = b'<p>Content</p>' * 100
+        cache.set('/a', long_content)
+        cache.set('/b/', b'B')
+        with open(os.path.join(self.dir, 'a.gz'), 'rb') as f:
+            self.assertEqual(zlib.decompress(f.read(), 16 + zlib.MAX_WBITS),
+                             long_content)
+        self.assertEqual(cache.get('/a'), long_content)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.dir, 'b/index.html.gz')))
+        self.assertEqual(cache.keys(), ['/a', '/b/'])
+
+        # A shorter value leaves no stale compressed copy behind.
+        cache.set('/a', b'A')
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'a.gz')))
+        cache.set('/a', long_content)
+        cache.delete('/a')
+        self.assertEqual(os.listdir(self.dir), ['b'])
+
+        http, location = cache.nginx_config('@django')
+        self.assertIn('gzip_static on;', location)
+
+    def test_nginx_config(self):
+        cache = StaticFileBasedCache(self.dir, {
+            'OPTIONS': {'LAYOUT': 'hashed'}})
+        http, location = cache.nginx_config('@django')
+        self.assertIn('map $ssify_md5 $ssify_file', http)
+        self.assertIn('try_files $ssify_file @django;', location)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import translation
+from ssify import includes, SsiVariable as V
+from tests import views
+
+
+class IncludePlanTestCase(TestCase):
+    def setUp(self):
+        includes._plans.clear()
+        self.request = RequestFactory().get('/')
+        self.request.ssi_vars_needed = {}
+        self.request.ssi_patch_response = []
+
+    def test_plan(self):
+        plan, url = includes.include_plan('quote', {'number': '0000'})
+        self.assertEqual(url, '/quote/0000')
+        self.assertFalse(plan.takes_lang)
+        self.assertIs(plan.get_ssi_vars, views.quote.get_ssi_vars)
+
+        plan, url = includes.include_plan('language_with_lang', {})
+        self.assertTrue(plan.takes_lang)
+        with translation.override('de'):
+            self.assertEqual(
+                includes.include_plan('language_with_lang', {})[1],
+                '/language/de')
+
+    def test_explicit_lang(self):
+        with translation.override('de'):
+            self.assertEqual(
+                includes.include_plan('language_with_lang', {'lang': 'en'})[1],
+                '/language/en')
+            self.assertEqual(
+                includes.ssi_include_statement(
+                    self.request, 'language_with_lang', {'lang': 'en'}),
+                "<!--#include file='/language/en'-->")
+
+    def test_statement(self):
+        number = V('test_tags.random_number', (), {'limit': 3})
+        for i in range(2):
+            self.assertEqual(
+                includes.ssi_include_statement(
+                    self.request, 'quote', {'number': number}),
+                "<!--#include file='/quote/%s'-->" % number.as_var())
+        self.assertEqual(len(includes._plans), 1)
+        self.assertEqual(
+            sorted(self.request.ssi_vars_needed),
+            sorted(V(*var).name
+                   for var in views.quote.get_ssi_vars(number=number)))
+
+    def test_statements(self):
+        number = V('test_tags.random_number', (), {'limit': 3})
+        statements = includes.ssi_include_statements(
+            self.request, 'quote',
+            [{'number': 1}, {'number': number}, {'number': 1}])
+        self.assertEqual(statements, [
+            "<!--#include file='/quote/1'-->",
+            "<!--#include file='/quote/%s'-->" % number.as_var(),
+            "<!--#include file='/quote/1'-->",
+        ])
+        self.assertEqual(len(self.request.ssi_vars_needed), 3)
+
+    def test_include_each(self):
+        output = Template(
+            "{% load ssify %}"
+            "{% ssi_include_each 'language_with_lang' 'lang' langs %}"
+            "{% ssi_include_each 'quote' 'number' numbers %}"
+        ).render(Context({'request': self.request, 'numbers': [1, 2],
+                          'langs': ['en', 'pl']}))
+        self.assertEqual(
+            output,
+            "<!--#include file='/language/en'-->"
+            "<!--#include file='/language/pl'-->"
+            "<!--#include file='/quote/1'-->"
+            "<!--#include file='/quote/2'-->")
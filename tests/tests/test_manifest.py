@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+from django.http import HttpResponse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.cache import patch_cache_control
+from ssify.cache import get_cache
+from ssify.manifest import MANIFEST_KEY, manifest_timeout, plans
+from tests.tests_utils import split_ssi
+
+
+RANDOM_QUOTE_SSI = sorted([
+    b"<!--#set var='va50d914691ecf9b421c680d93ba1263e' value='22'-->",
+    b"<!--#set var='ve5c36b96d4e99e5853b7fae1e2066423' value='4'-->",
+    b"<!--#set var='vafe010f2e683908fee32c48d01bb2650' value=''-->",
+    b"<!--#include file='/random_quote'-->"])
+
+
+class ManifestTestCase(TestCase):
+    def setUp(self):
+        get_cache('default').clear()
+        plans.clear()
+
+    def test_vars_header(self):
+        for i in range(3):
+            response = self.client.get('/')
+            self.assertEqual(sorted(split_ssi(response.content)),
+                             RANDOM_QUOTE_SSI)
+        self.assertIn('X-Ssi-Vars-Needed', response)
+        # Decoded only on the first cache hit.
+        self.assertEqual((plans.hits, plans.misses), (1, 1))
+
+    @override_settings(SSIFY_VARS_MANIFEST_CACHE='ssify')
+    def test_manifest(self):
+        for i in range(3):
+            response = self.client.get('/')
+            self.assertEqual(sorted(split_ssi(response.content)),
+                             RANDOM_QUOTE_SSI)
+        self.assertNotIn('X-Ssi-Vars-Needed', response)
+        self.assertIn('X-Ssi-Vars-Manifest', response)
+        self.assertEqual((plans.hits, plans.misses), (1, 1))
+
+    @override_settings(SSIFY_VARS_MANIFEST_CACHE='ssify')
+    def test_manifest_missing(self):
+        self.client.get('/')
+        response = self.client.get('/')
+        get_cache('ssify').delete(
+            MANIFEST_KEY % response['X-Ssi-Vars-Manifest'])
+        plans.clear()
+        # The page is served without the variables, and not cached.
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(split_ssi(response.content)),
+                         [b"<!--#include file='/random_quote'-->"])
+        self.assertIn('max-age=0', response['Cache-Control'])
+
+    def test_manifest_timeout(self):
+        response = HttpResponse()
+        with self.settings(CACHE_MIDDLEWARE_SECONDS=600):
+            self.assertEqual(manifest_timeout(response), 1200)
+            patch_cache_control(response, max_age=30)
+            self.assertEqual(manifest_timeout(response), 60)
+        with self.settings(SSIFY_VARS_MANIFEST_TIMEOUT=10):
+            self.assertEqual(manifest_timeout(response), 10)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+import socket
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from ssify import metrics
+from ssify.cache import get_cache
+
+
+@override_settings(SSIFY_METRICS_COLLECTOR='ssify.metrics.MemoryCollector')
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        get_cache('default').clear()
+
+    def test_disabled(self):
+        with self.settings(SSIFY_METRICS_COLLECTOR=None):
+            self.assertIsNone(metrics.get_collector())
+            self.client.get('/random_quote')
+
+    def test_collect(self):
+        collector = metrics.get_collector()
+        self.assertIs(collector, metrics.get_collector())
+        self.client.get('/')
+        self.assertEqual(
+            collector.counters[('includes_total',
+                                (('view', 'random_quote'),))], 1)
+        self.assertEqual(
+            collector.counters[('variables_computed_total',
+                                (('variable', 'test_tags.random_number'),))],
+            1)
+        count, total = collector.summaries[('provide_vars_seconds', ())]
+        self.assertEqual(count, 1)
+        self.assertEqual(collector.summaries[('page_variables', ())], (1, 3))
+        self.assertIn(('prepare_for_cache_seconds', ()), collector.summaries)
+
+        self.client.get('/quote/1')
+        self.assertIn(('cache_write_seconds', (('cache', 'ssify'),)),
+                      collector.summaries)
+
+    def test_prometheus(self):
+        collector = metrics.get_collector()
+        collector.increment('includes_total', 2, {'view': 'a"b'})
+        collector.observe('provide_vars_seconds', 0.5)
+        collector.observe('provide_vars_seconds', 0.25)
+        response = metrics.prometheus_view(RequestFactory().get('/metrics'))
+        self.assertEqual(
+            response.content,
+            b'# TYPE ssify_includes_total counter\n'
+            b'ssify_includes_total{view="a\\"b"} 2\n'
+            b'# TYPE ssify_provide_vars_seconds summary\n'
+            b'ssify_provide_vars_seconds_count 2\n'
+            b'ssify_provide_vars_seconds_sum 0.75\n')
+
+    def test_statsd(self):
+        self.assertEqual(
+            metrics.statsd_line('includes_total', 2, 'c', {'view': 'a.b'}),
+            'ssify.includes_total.a_b:2|c')
+        self.assertEqual(
+            metrics.statsd_line('provide_vars_seconds', 0.5, 'o'),
+            'ssify.provide_vars:500.000|ms')
+        self.assertEqual(
+            metrics.statsd_line('page_variables', 3, 'o'),
+            'ssify.page_variables:3|h')
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        try:
+            collector = metrics.StatsdCollector(*server.getsockname())
+            collector.increment('includes_total')
+            self.assertEqual(server.recv(1024), b'ssify.includes_total:1|c')
+        finally:
+            server.close()
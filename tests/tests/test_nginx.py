@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from ssify.nginx import memcached_location
+
+
+class NginxConfTestCase(TestCase):
+    def nginx_conf(self, caches, **options):
+        caches = dict(caches, default={
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        with self.settings(CACHES=caches, SSIFY_CACHE_ALIASES=['ssify']):
+            stdout = StringIO()
+            call_command('ssify_nginx_conf', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_static(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            config = self.nginx_conf({'ssify': {
+                'BACKEND': 'ssify.cache_backends.StaticFileBasedCache',
+                'LOCATION': tmpdir,
+            }}, upstream='unix:/tmp/django.sock')
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertIn('server unix:/tmp/django.sock;', config)
+        self.assertIn('ssi on;', config)
+        self.assertIn('ssi_value_length 256;', config)
+        self.assertIn(
+            '    location ~ "^/quote/(?P<number>.+)$" {\n'
+            '        default_type text/html;\n'
+            '        root %s;\n'
+            '        try_files $uri $uri/index.html @django;\n'
+            '    }\n' % tmpdir, config)
+        # Not an included view.
+        self.assertNotIn('"^/csrf_check$"', config)
+        self.assertIn('location @django {', config)
+
+    def test_memcached(self):
+        cache = BaseMemcachedCache('127.0.0.1:11211', {'KEY_PREFIX': 'inc'},
+                                   None, ValueError)
+        self.assertEqual(
+            memcached_location(cache, '@django'),
+            'set $memcached_key "inc:1:$uri";\n'
+            'memcached_pass 127.0.0.1:11211;\n'
+            'default_type text/html;\n'
+            'error_page 404 502 504 = @django;\n')
+        # Nginx can't choose the server like the client library does.
+        cache = BaseMemcachedCache('127.0.0.1:11211;127.0.0.1:11212', {},
+                                   None, ValueError)
+        self.assertIsNone(memcached_location(cache, '@django'))
+
+    def test_unsupported(self):
+        config = self.nginx_conf({'ssify': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+        self.assertIn('None of the caches can be read by nginx', config)
+        self.assertNotIn('location ~', config)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from ssify.cache import flush_ssi_includes
+from ssify.middleware_debug import SsiRenderer
+from tests.views import QUOTES
+
+
+NESTED_IFS = (b"<!--#set var='a' value='1'--><!--#set var='b' value=''-->"
+              b"<!--#if expr='${a}'-->A"
+              b"<!--#if expr='${b}'-->B<!--#else-->C<!--#endif-->"
+              b"D<!--#else-->E"
+              b"<!--#if expr='${a}'-->F<!--#endif-->"
+              b"<!--#endif-->")
+
+
+class RenderTestCase(TestCase):
+    def render(self, chunks):
+        renderer = SsiRenderer(RequestFactory().get('/'))
+        return b"".join(renderer.render(chunks))
+
+    def test_nested_ifs(self):
+        self.assertEqual(self.render([NESTED_IFS]), b"ACD")
+
+    def test_chunks(self):
+        for size in (1, 3, 7):
+            chunks = [NESTED_IFS[i:i + size]
+                      for i in range(0, len(NESTED_IFS), size)]
+            self.assertEqual(self.render(chunks), b"ACD")
+
+    def test_escaped_value(self):
+        self.assertEqual(
+            self.render([b"<!--#set var='a' value='it\\'s'-->"
+                         b"<p><!--#echo var='a' encoding='none'--></p>"]),
+            b"<p>it's</p>")
+
+    @override_settings(SSIFY_RENDER=True)
+    def test_render_streaming(self):
+        response = self.client.get('/quote_lens_streaming')
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            b"".join(response.streaming_content),
+            ("%d\n%d\n" % (len(QUOTES[3]), len(QUOTES[4]))).encode('ascii'))
+
+    @override_settings(SSIFY_RENDER=True)
+    def test_render_includes(self):
+        flush_ssi_includes()
+        # First render the views, then take them from cache.
+        for i in range(2):
+            response = self.client.get('/quotes')
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            position = 0
+            for number in (1, 2, 3):
+                line = ("%s\nLine %d of %d" % (
+                    QUOTES[number], number, len(QUOTES))).encode('ascii')
+                self.assertIn(line, response.content[position:])
+                position = response.content.index(line)
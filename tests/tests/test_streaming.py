@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from ssify.variables import SsiVariable as V
+from tests.views import QUOTES
+
+
+class StreamingTestCase(TestCase):
+    def test_streaming(self):
+        response = self.client.get('/quote_lens_streaming')
+        self.assertTrue(response.streaming)
+        chunks = []
+        for number in (3, 4):
+            name = V('test_tags.quote_len', [number]).name
+            chunks.append(("<!--#set var='%s' value='%d'-->" % (
+                name, len(QUOTES[number]))).encode('ascii'))
+            chunks.append(("<!--#echo var='%s' encoding='none'-->\n" % (
+                name)).encode('ascii'))
+        self.assertEqual(list(response.streaming_content), chunks)
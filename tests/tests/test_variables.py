@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+from threading import current_thread
+import time
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from ssify import variables
+from django.utils.translation import override, ugettext_lazy
+from ssify.exceptions import (SsiValueTooLongError,
+                              SsiVarsDependencyCycleError,
+                              SsiVarsDependencyMissingError)
+from ssify.variables import (SsiExpect, SsiVariable as V, escaped_value,
+                             provide_vars, set_statements,
+                             ssi_set_statement)
+from ssify.memo import request_memo, shared_memo
+from tests.templatetags.test_tags import (quote_len_batches,
+                                         shared_counter_calls, slow_threads)
+from tests.tests_utils import split_ssi
+from tests.views import QUOTES
+
+
+class ProvideVarsTestCase(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+
+    def test_chain(self):
+        qlen = V('test_tags.number_of_quotes')
+        number = V('test_tags.random_number', [], {'limit': qlen})
+        odd = V('test_tags.quote_len_odd', [SsiExpect(number.name)])
+        ssi_vars = dict((var.name, var) for var in (odd, number, qlen))
+        self.assertEqual(
+            sorted(split_ssi(provide_vars(self.request, ssi_vars))),
+            sorted([b"<!--#set var='va50d914691ecf9b421c680d93ba1263e' value='22'-->",
+                    b"<!--#set var='ve5c36b96d4e99e5853b7fae1e2066423' value='4'-->",
+                    b"<!--#set var='vafe010f2e683908fee32c48d01bb2650' value=''-->"])
+        )
+
+    def test_fill_expects(self):
+        qlen = V('test_tags.number_of_quotes')
+        number = V('test_tags.random_number', [], {'limit': qlen})
+        # Variables without SsiExpects are reused, names and all.
+        self.assertIs(variables._fill_expects(number, {}, {}), number)
+        odd = V('test_tags.quote_len_odd', [SsiExpect(number.name)])
+        self.assertEqual(
+            variables._fill_expects(odd, {number.name: 4}, {}),
+            V('test_tags.quote_len_odd', [4]))
+        # Nested variables already filled in are taken as they are.
+        nested = V('test_tags.random_number', [], {'limit': odd})
+        filled = V('test_tags.quote_len_odd', [5])
+        self.assertEqual(
+            variables._fill_expects(nested, {}, {odd.name: filled}),
+            V('test_tags.random_number', [], {'limit': filled}))
+
+    def test_deep_chain(self):
+        ssi_vars = [V('test_tags.number_of_quotes')]
+        for i in range(200):
+            ssi_vars.append(
+                V('test_tags.random_number', [], {'limit': ssi_vars[-1]}))
+        levels = variables.resolution_levels(
+            None, dict((var.name, var) for var in ssi_vars))
+        self.assertEqual(levels, [[var.name] for var in ssi_vars])
+
+    def test_cycle(self):
+        ssi_vars = {
+            'a': V('test_tags.random_number', [SsiExpect('b')]),
+            'b': V('test_tags.random_number', [SsiExpect('c')]),
+            'c': V('test_tags.random_number', [SsiExpect('a')]),
+            'd': V('test_tags.random_number', [5]),
+        }
+        with self.assertRaises(SsiVarsDependencyCycleError) as cm:
+            provide_vars(self.request, ssi_vars)
+        self.assertEqual(cm.exception.args[2], ['a', 'b', 'c', 'a'])
+        self.assertEqual(cm.exception.args[1], ['d'])
+
+    def test_missing(self):
+        ssi_vars = {
+            'a': V('test_tags.random_number', [SsiExpect('b')]),
+        }
+        with self.assertRaises(SsiVarsDependencyMissingError) as cm:
+            provide_vars(self.request, ssi_vars)
+        self.assertEqual(list(cm.exception.args[0]), ['b'])
+
+    def test_batch(self):
+        del quote_len_batches[:]
+        ssi_vars = dict((var.name, var) for var in (
+            V('test_tags.quote_len', [1]),
+            V('test_tags.quote_len', [], {'which': 2}),
+            V('test_tags.quote_len', [SsiExpect('number')]),
+        ))
+        ssi_vars['number'] = V('test_tags.random_number', [4])
+        output = provide_vars(self.request, ssi_vars)
+
+        # One call for the independent variables, one for the dependent.
+        self.assertEqual(len(quote_len_batches), 2)
+        self.assertEqual(sorted(quote_len_batches[0]), [(1,), (2,)])
+        self.assertEqual(quote_len_batches[1], [(3,)])
+        for var, which in (
+                (V('test_tags.quote_len', [1]), 1),
+                (V('test_tags.quote_len', [], {'which': 2}), 2),
+                (V('test_tags.quote_len', [3]), 3)):
+            self.assertIn(
+                ("<!--#set var='%s' value='%d'-->" % (
+                    var.name, len(QUOTES[which]))).encode('ascii'),
+                output)
+
+
+class MemoTestCase(TestCase):
+    def setUp(self):
+        shared_memo.clear()
+        del shared_counter_calls[:]
+
+    def test_request_memo(self):
+        request = RequestFactory().get('/')
+        var = V('test_tags.random_number', [4])
+        self.assertEqual(var.get_value(request), 3)
+        provide_vars(request, {var.name: var})
+        memo = request_memo(request)
+        self.assertEqual((memo.hits, memo.misses), (1, 1))
+
+        # Another request doesn't share the memo.
+        other = RequestFactory().get('/')
+        provide_vars(other, {var.name: var})
+        self.assertEqual(request_memo(other).misses, 1)
+
+    def test_shared_memo(self):
+        var = V('test_tags.shared_counter')
+        for i in range(3):
+            self.assertEqual(
+                provide_vars(RequestFactory().get('/'), {var.name: var}),
+                ("<!--#set var='%s' value='1'-->" % var.name).encode('ascii'))
+        self.assertEqual(len(shared_counter_calls), 1)
+        self.assertEqual((shared_memo.hits, shared_memo.misses), (2, 1))
+
+    def test_shared_memo_timeout(self):
+        var = V('test_tags.shared_counter')
+        shared_memo.set(var.name, 'stale', -1)
+        self.assertEqual(var.get_value(RequestFactory().get('/')), 1)
+        self.assertEqual(shared_memo.misses, 1)
+
+
+class NameTestCase(TestCase):
+    def tearDown(self):
+        variables._names.clear()
+
+    def test_interned(self):
+        var = V('test_tags.random_number', [], {'limit': 4})
+        self.assertIs(V('test_tags.random_number', [], {'limit': 4}).name,
+                      var.name)
+        # Same values of different types are encoded differently.
+        self.assertNotEqual(
+            V('test_tags.random_number', [True]).name,
+            V('test_tags.random_number', [1]).name)
+
+    def test_interned_nested(self):
+        nested = V('test_tags.number_of_quotes', name='vnested')
+        key = variables._interning_key(
+            V('test_tags.random_number', [], {'limit': nested}).definition)
+        # The nested variable is only represented by its name.
+        self.assertIn('<vnested>', key)
+        self.assertNotIn('number_of_quotes', key)
+
+    def test_unchanged_names(self):
+        # Names without kwargs are the same as in earlier versions.
+        self.assertEqual(V('test_tags.random_number', [4]).name,
+                         'vf6aba0780227af845107c046f336cc8a')
+        self.assertEqual(
+            V('test_tags.random_number',
+              [V('test_tags.number_of_quotes')]).name,
+            'va1e20953513dd46431a165c53ecd7057')
+
+    def test_kwargs_order(self):
+        kwargs = dict(('k%d' % i, i) for i in range(20))
+        self.assertEqual(
+            V('test_tags.random_number', [], kwargs).name,
+            V('test_tags.random_number', [],
+              dict(reversed(list(kwargs.items())))).name)
+
+    def test_deep_chain(self):
+        var = V('test_tags.number_of_quotes')
+        for i in range(200):
+            var = V('test_tags.random_number', [], {'limit': var})
+        name = var.name
+        variables._names.clear()
+        self.assertEqual(
+            V('test_tags.random_number', [], var.kwargs).rehash(), name)
+
+    @override_settings(SSIFY_VARIABLE_NAME_DIGEST='crc')
+    def test_crc_digest(self):
+        variables._names.clear()
+        self.assertEqual(V('test_tags.number_of_quotes').name,
+                         'v804e9c0bb4900bb6')
+
+
+class VariableTestCase(TestCase):
+    def test_compact(self):
+        var = V('test_tags.random_number', [4])
+        self.assertFalse(hasattr(var, '__dict__'))
+        self.assertEqual(var.args, (4,))
+        self.assertFalse(hasattr(SsiExpect(var.name), '__dict__'))
+
+    def test_equality(self):
+        self.assertEqual(V('test_tags.random_number', [4]),
+                         V('test_tags.random_number', (4,)))
+        self.assertNotEqual(V('test_tags.random_number', [4]),
+                            V('test_tags.random_number', [5]))
+        self.assertEqual(
+            len(set([V('test_tags.random_number', [4]),
+                     V('test_tags.random_number', [4]),
+                     SsiExpect('a'), SsiExpect('a')])),
+            2)
+
+
+@override_settings(SSIFY_VARIABLE_THREADS=4)
+class ThreadsTestCase(TestCase):
+    def setUp(self):
+        del slow_threads[:]
+
+    def test_concurrent(self):
+        squares = [V('test_tags.slow_square', [i]) for i in range(4)]
+        unsafe = V('test_tags.unsafe_number', [3])
+        dependent = V('test_tags.slow_square', [unsafe])
+        all_vars = squares + [unsafe, dependent]
+        ssi_vars = dict((var.name, var) for var in all_vars)
+        start = time.time()
+        output = provide_vars(RequestFactory().get('/'), ssi_vars)
+        # Two levels of dependencies.
+        self.assertLess(time.time() - start, .6)
+        for var, value in zip(all_vars, [0, 1, 4, 9, 3, 9]):
+            self.assertIn(
+                ("<!--#set var='%s' value='%d'-->" % (var.name, value)
+                 ).encode('ascii'), output)
+
+        main = current_thread().name
+        self.assertEqual(slow_threads.count(('unsafe_number', main)), 1)
+        self.assertEqual(
+            len([thread for tag, thread in slow_threads
+                 if tag == 'slow_square' and thread != main]),
+            4)
+
+
+class SetStatementsTestCase(TestCase):
+    def test_escaped_value(self):
+        self.assertEqual(escaped_value("it's a \\"), b"it\\'s a \\\\")
+        self.assertEqual(escaped_value(1), b'1')
+        self.assertEqual(escaped_value(True), b'True')
+        self.assertEqual(escaped_value(False), b'')
+        self.assertEqual(escaped_value(None), b'')
+        with override('en'):
+            self.assertEqual(escaped_value(ugettext_lazy('Yes')), b'Yes')
+        self.assertEqual(escaped_value('zażółć'),
+                         'zażółć'.encode('utf-8'))
+
+    def test_set_statements(self):
+        self.assertEqual(
+            set_statements(RequestFactory().get('/'), {'a': 1}),
+            b"<!--#set var='a' value='1'-->")
+        self.assertEqual(ssi_set_statement('a', "it's"),
+                         "<!--#set var='a' value='it\\'s'-->")
+
+    @override_settings(SSIFY_SSI_VALUE_LENGTH=10,
+                       SSIFY_SSI_VALUE_TOO_LONG='raise')
+    def test_too_long(self):
+        request = RequestFactory().get('/')
+        self.assertEqual(
+            set_statements(request, {'a': "x" * 10}),
+            b"<!--#set var='a' value='xxxxxxxxxx'-->")
+        # nginx stores an escaped quote as one byte.
+        self.assertEqual(
+            set_statements(request, {'a': "'" * 10}),
+            b"<!--#set var='a' value='" + b"\\'" * 10 + b"'-->")
+        with self.assertRaises(SsiValueTooLongError) as cm:
+            set_statements(request, {'a': "'" * 11})
+        self.assertIn('SSIFY_SSI_VALUE_LENGTH=10', '%s' % cm.exception)
+        # But it keeps escaped backslashes as they are.
+        with self.assertRaises(SsiValueTooLongError):
+            set_statements(request, {'a': "\\" * 6})
+
+    @override_settings(SSIFY_SSI_VALUE_LENGTH=10)
+    def test_truncate(self):
+        request = RequestFactory().get('/')
+        self.assertEqual(
+            set_statements(request, {'a': "x" * 20}),
+            b"<!--#set var='a' value='xxxxxxxxxx'-->")
+        # Escape sequences and characters aren't split.
+        self.assertEqual(
+            set_statements(request, {'a': "x" * 9 + "\\x"}),
+            b"<!--#set var='a' value='xxxxxxxxx'-->")
+        self.assertEqual(
+            set_statements(request, {'a': "x'" * 10}),
+            b"<!--#set var='a' value='" + b"x\\'" * 5 + b"'-->")
+        self.assertEqual(
+            set_statements(request, {'a': "xxxxxxxxxżółć"}),
+            b"<!--#set var='a' value='xxxxxxxxx'-->")
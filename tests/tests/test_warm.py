@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# This file is part of django-ssify, licensed under GNU Affero GPLv3 or later.
+# Copyright © Fundacja Nowoczesna Polska. See README.md for more information.
+#
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from ssify.cache import get_cache
+from ssify.warm import render_path, warm_paths
+from .test_cache import CACHES
+
+
+@override_settings(CACHES=CACHES, SSIFY_CACHE_ALIASES=['a'],
+                   LANGUAGES=[('en', 'English'), ('pl', 'Polish')])
+class WarmTestCase(TestCase):
+    def setUp(self):
+        get_cache('a').clear()
+        self.dir = tempfile.mkdtemp()
+        self.state = os.path.join(self.dir, 'state')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_warm_paths(self):
+        paths = list(warm_paths())
+        for path in ('/quote/1', '/quote/2', '/language/en',
+                     '/language/pl', '/language', '/books'):
+            self.assertIn(path, paths)
+        # No way of knowing the arguments.
+        self.assertNotIn('/args/3', paths)
+        self.assertEqual(len(paths), len(set(paths)))
+
+    def test_render_path(self):
+        signals = []
+
+        def started(**kwargs):
+            signals.append('started')
+
+        def finished(**kwargs):
+            signals.append('finished')
+
+        request_started.connect(started)
+        request_finished.connect(finished)
+        try:
+            self.assertEqual(render_path('/quote/1'), ('/quote/1', 200))
+        finally:
+            request_started.disconnect(started)
+            request_finished.disconnect(finished)
+        self.assertEqual(signals, ['started', 'finished'])
+        self.assertIsNotNone(get_cache('a').get('/quote/1'))
+
+    def test_warm(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('ssify_warm', processes=1, state=self.state,
+                     stdout=stdout, stderr=stderr)
+        self.assertIsNotNone(get_cache('a').get('/quote/1'))
+        self.assertEqual(get_cache('a').get('/language/pl'), b'pl')
+        with open(self.state) as state_file:
+            rendered = state_file.read().split()
+        self.assertIn('/quote/2', rendered)
+        # This one lacks the lang argument.
+        self.assertEqual(stderr.getvalue(), '/bad_language: 500\n')
+        self.assertIn('Rendered %d paths, 1 failed.' % len(rendered),
+                      stdout.getvalue())
+
+        # Resume.
+        stdout = StringIO()
+        call_command('ssify_warm', processes=1, state=self.state,
+                     stdout=stdout, stderr=StringIO())
+        self.assertIn('Rendered 0 paths, 1 failed.', stdout.getvalue())
+
+    def test_warm_missing(self):
+        get_cache('a').set('/quote/1', b'cached')
+        call_command('ssify_warm', processes=1, missing=True,
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(get_cache('a').get('/quote/1'), b'cached')
+        self.assertIsNotNone(get_cache('a').get('/quote/2'))
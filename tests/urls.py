@@ -37,6 +37,20 @@ urlpatterns = patterns(
         ),
     url(r'^args/(?P<limit>\d+)$', 'args', name='args'),
 
+    # tests.streaming
+    url(r'^quote_lens_streaming$', 'quote_lens_streaming'),
+
+    # tests.render
+    url(r'^quotes$',
+        TemplateView.as_view(template_name='tests_render/quotes.html'),
+        ),
+
+    # tests.cache
+    url(r'^book/(?P<pk>\d+)$', 'book', name='book'),
+    url(r'^books$', 'books', name='books'),
+    url(r'^renders$', 'renders', name='renders'),
+    url(r'^stale_undeclared$', 'stale_undeclared'),
+
     # tests.csrf
     url(r'^csrf$',
         TemplateView.as_view(template_name='tests_csrf/csrf_token.html'),
@@ -4,16 +4,22 @@
 #
 from __future__ import unicode_literals
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.template.response import TemplateResponse
+from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.utils import translation
-from ssify import ssi_included, ssi_expect, SsiVariable as V
+from ssify import (ssi_depends_on, ssi_included, ssi_expect,
+                   SsiVariable as V)
+from .models import Book
 
 
 @ssi_included(use_lang=False, get_ssi_vars=lambda number: [
     ('test_tags.number_of_quotes',),
     ('test_tags.quote_len_odd', [ssi_expect(number, int)])
-])
+], tags=lambda number: ['quote:%s' % number],
+   warm_kwargs=lambda: [{'number': 1}, {'number': 2}])
 def quote(request, number):
     number = int(number)
     return render(request, 'tests_basic/quote.html', {
@@ -87,6 +93,43 @@ def args(request, limit):
     return render(request, 'tests_args/args.html', {'limit': int(limit)})
 
 
+def quote_lens_streaming(request):
+    def content():
+        for number in (3, 4):
+            yield render_to_string('tests_streaming/quote_len.html',
+                                   {'number': number},
+                                   RequestContext(request))
+    return StreamingHttpResponse(content())
+
+
+@ssi_included(use_lang=False)
+def book(request, pk):
+    book = Book.objects.get(pk=pk)
+    ssi_depends_on(request, book)
+    return HttpResponse(book.title)
+
+
+@ssi_included(use_lang=False, depends_on=lambda: [Book])
+def books(request):
+    return HttpResponse(', '.join(
+        book.title for book in Book.objects.order_by('pk')))
+
+
+@ssi_included(use_lang=False, timeout=60, stale_timeout=600)
+def renders(request):
+    renders.count += 1
+    return HttpResponse('%d' % renders.count)
+renders.count = 0
+
+
+@ssi_included(use_lang=False, stale_timeout=600, warm_kwargs=lambda: [])
+def stale_undeclared(request):
+    return TemplateResponse(request, 'tests_basic/quote.html', {
+        'number': 1,
+        'quote': QUOTES[1]
+    })
+
+
 def csrf_check(request):
     return HttpResponse(request.POST['test'])
 